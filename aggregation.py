@@ -0,0 +1,99 @@
+from data_store import DataFrameCache
+import pandas as pd
+import json
+import os
+
+AGGREGATIONS = {"sum", "mean", "median", "count", "nunique"}
+# Chart spec time buckets mapped to pandas period frequencies
+TIME_BUCKETS = {"hour": "h", "day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+OTHER_LABEL = "Other"
+
+AGGREGATE_CACHE_MB = float(os.getenv('AGGREGATE_CACHE_MB', '256'))
+
+aggregate_cache = DataFrameCache(int(AGGREGATE_CACHE_MB * 1024 * 1024))
+
+
+def normalize_aggregation(chart_specs, x_column, y_column, group_by=None):
+    """Build the aggregation spec for a chart from its resolved columns and optional fields
+
+    Returns None when the chart should plot raw rows. Unknown agg or
+    time_bucket values are ignored rather than failing the chart.
+    """
+    agg = chart_specs.get("agg")
+    agg = agg.lower() if isinstance(agg, str) and agg.lower() in AGGREGATIONS else None
+    time_bucket = chart_specs.get("time_bucket")
+    time_bucket = time_bucket.lower() if isinstance(time_bucket, str) and time_bucket.lower() in TIME_BUCKETS else None
+    top_n = chart_specs.get("top_n")
+    top_n = int(top_n) if isinstance(top_n, (int, float)) and not isinstance(top_n, bool) and top_n > 0 else None
+
+    if y_column is None:
+        agg = "count"
+    if agg is None and time_bucket is None and top_n is None:
+        return None
+    return {
+        "chart_type": chart_specs.get("chart_type"),
+        "x_column": x_column,
+        "y_column": y_column,
+        "agg": agg or "sum",
+        "group_by": group_by if group_by not in (x_column, y_column) else None,
+        "time_bucket": time_bucket,
+        "top_n": top_n
+    }
+
+
+def value_column(spec):
+    """Name of the aggregated value column in the result frame"""
+    return spec["y_column"] or "count"
+
+
+def aggregate(df, spec):
+    """Run a chart aggregation as one vectorized group-by and return the small result frame"""
+    x, y, group = spec["x_column"], spec["y_column"], spec["group_by"]
+    columns = list(dict.fromkeys(c for c in (x, y, group) if c is not None))
+    data = df[columns]
+
+    if spec["time_bucket"]:
+        dates = data[x] if data[x].dtype.kind == "M" else pd.to_datetime(data[x], errors="coerce")
+        data = data.assign(**{x: dates.dt.to_period(TIME_BUCKETS[spec["time_bucket"]]).dt.start_time})
+
+    keys = [x] + ([group] if group else [])
+    grouped = data.groupby(keys, observed=True, sort=True, dropna=True)
+    if y is None or spec["agg"] == "count":
+        result = grouped.size() if y is None else grouped[y].count()
+    else:
+        result = grouped[y].agg(spec["agg"])
+    result = result.rename(value_column(spec)).reset_index()
+
+    if spec["top_n"]:
+        result = _top_n(result, spec)
+    elif y is None and not spec["time_bucket"]:
+        # Plain counts keep value_counts ordering, largest first
+        result = result.sort_values(value_column(spec), ascending=False, kind="stable")
+    return result.reset_index(drop=True)
+
+
+def _top_n(result, spec):
+    x, value, group = spec["x_column"], value_column(spec), spec["group_by"]
+    totals = result.groupby(x, observed=True, sort=False)[value].sum().sort_values(ascending=False)
+    top = totals.index[:spec["top_n"]]
+    in_top = result[x].isin(top)
+    if spec["chart_type"] == "pie" and not in_top.all():
+        # Fold everything outside the top N into a single slice
+        other = pd.DataFrame({x: [OTHER_LABEL], value: [result.loc[~in_top, value].sum()]})
+        kept = result.loc[in_top, [x, value]]
+        kept = kept.astype({x: object}) if isinstance(kept[x].dtype, pd.CategoricalDtype) else kept
+        return pd.concat([kept, other], ignore_index=True)
+    result = result[in_top]
+    if spec["time_bucket"]:
+        return result
+    # Largest categories first
+    order = {key: rank for rank, key in enumerate(top)}
+    return result.sort_values(x, key=lambda s: s.map(order), kind="stable")
+
+
+def cached_aggregate(df, spec, fingerprint=None):
+    """Aggregate through the process-wide cache when the dataset fingerprint is known"""
+    if fingerprint is None:
+        return aggregate(df, spec)
+    key = f"{fingerprint}:{json.dumps(spec, sort_keys=True)}"
+    return aggregate_cache.get_or_load(key, lambda: aggregate(df, spec))
@@ -1,11 +1,32 @@
+# Imported first so the timer covers importing everything else
+from run_timing import run_timings
+run_timer = run_timings.start()
+
 import streamlit as st
 import pandas as pd
 import os
 from dotenv import load_dotenv
-from utils import create_presentation, generate_chart
-from chat_handler import chat_with_data
-from PIL import Image
-import base64
+from utils import EXPORT_IMAGE_PRESET, PresentationBuilder, generate_chart
+from renderer_pool import RENDERER_WARM_ON_START, renderer_pool
+from chat_handler import chat_with_data, message_figures, render_chart, stream_chat_with_data
+from data_store import load_uploaded_dataframe
+from profiling import profile_cache
+from pages.logs import show_logs
+from latency import latency_stats, span, trace
+from log_store import log_store
+from static_assets import assistant_avatar, page_css
+
+# Stream assistant replies into the chat pane instead of waiting for the full response
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+# Charts of this many most recent assistant replies are always drawn; older ones on request
+CHAT_EXPANDED_TURNS = int(os.getenv("CHAT_EXPANDED_TURNS", "3"))
+# How often the statistics wait checks on a background profile
+PROFILE_POLL_SECONDS = 0.5
+run_timer.mark("imports")
+
+# Start the chart image renderers in the background so the first export doesn't wait for Chromium
+if RENDERER_WARM_ON_START:
+    renderer_pool.warm()
 
 # Set page config must be the first Streamlit command
 st.set_page_config(
@@ -15,131 +36,43 @@ st.set_page_config(
     menu_items={} 
 )
 
-# Add CSS to hide only the menu items we want to hide
-st.markdown("""
-    <style>
-        /* Hide main menu button and footer */
-        #MainMenu {visibility: hidden;}
-        footer {visibility: hidden;}
-        
-        /* Hide top-level navigation items */
-        header {visibility: hidden;}
-        
-        /* Hide default page navigation */
-        [data-testid="stSidebarNav"] {display: none;}
-        
-        /* Hide the close button and its background */
-        button[kind="header"] {display: none;}
-        .st-emotion-cache-r421ms {display: none;}
-        .st-emotion-cache-1dp5vir {display: none;}
-        
-        /* Ensure sidebar content is visible */
-        [data-testid="stSidebar"] {
-            visibility: visible !important;
-            height: 100% !important;
-        }
-        
-        /* Ensure sidebar content is visible */
-        [data-testid="stSidebarContent"] {
-            visibility: visible !important;
-        }
-        
-        /* Improve image quality */
-        img {
-            image-rendering: -webkit-optimize-contrast;
-            image-rendering: crisp-edges;
-        }
-        
-        /* Center logo container */
-        .logo-container {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            padding: 1rem 0;
-        }
-        
-        /* Style for navigation menu */
-        .nav-menu {
-            margin: 1rem 0;
-            padding: 0.5rem 0;
-            border-radius: 4px;
-        }
-        
-        /* Style the selectbox */
-        .nav-menu .stSelectbox {
-            font-family: 'PfizerTomorrow', sans-serif !important;
-        }
-        
-        .nav-menu .stSelectbox > div > div {
-            padding: 0.5rem 1rem;
-            cursor: pointer;
-        }
-        
-        .nav-menu .stRadio > label {
-            font-family: 'PfizerTomorrow', sans-serif !important;
-            padding: 0.5rem 1rem;
-            cursor: pointer;
-        }
-        
-        .nav-menu .stRadio > label:hover {
-            background-color: rgba(0, 0, 238, 0.1);
-        }
-    </style>
-""", unsafe_allow_html=True)
+# A few KB of page styles; the font itself is a static file the browser caches
+st.markdown(page_css(), unsafe_allow_html=True)
+run_timer.mark("styles")
 
-# Function to load and encode font file
-def get_font_base64(font_path):
-    if os.path.exists(font_path):
-        with open(font_path, "rb") as font_file:
-            return base64.b64encode(font_file.read()).decode()
-    return None
+def show_profile(box, status, df, fingerprint, exact_stats):
+    """Draw the dataset statistics into box; return True while a better profile is still being computed"""
+    profile = profile_cache.get(fingerprint, df)
+    pending = False
+    if exact_stats:
+        exact_profile = profile_cache.get_exact(fingerprint, df)
+        if exact_profile is not None:
+            profile = exact_profile
+        elif profile_cache.is_pending(fingerprint):
+            status.caption("Computing exact statistics...")
+            pending = True
+    elif profile["partial"]:
+        status.caption("Computing distinct values and duplicates...")
+        pending = profile_cache.is_pending(fingerprint, exact=False)
+    if not pending:
+        status.empty()
+    stats = {
+        "Total Rows": profile["rows"],
+        "Total Columns": profile["columns"],
+        "Missing Values": profile["missing"],
+        "Duplicate Rows" if profile["exact"] else "Duplicate Rows (approx.)": profile["duplicates"]
+    }
+    with box.container():
+        for metric, value in stats.items():
+            st.metric(metric, value)
+        with st.expander("Column profile"):
+            st.dataframe(
+                pd.DataFrame(profile["column_stats"]).astype({"min": str, "max": str}),
+                hide_index=True,
+                use_container_width=True
+            )
+    return pending
 
-# Load custom font
-current_dir = os.path.dirname(os.path.abspath(__file__))
-font_path = os.path.join(current_dir, "assets", "PfizerTomorrow-regular.otf")
-font_base64 = get_font_base64(font_path)
-
-# Add custom font CSS if font was loaded successfully
-if font_base64:
-    st.markdown(f"""
-        <style>
-            @font-face {{
-                font-family: 'PfizerTomorrow';
-                src: url(data:font/otf;base64,{font_base64}) format('opentype');
-            }}
-            
-            h1, h2, h3, h4, h5, h6 {{
-                font-family: 'PfizerTomorrow', sans-serif !important;
-            }}
-            
-            .stMarkdown h1, .stMarkdown h2, .stMarkdown h3 {{
-                font-family: 'PfizerTomorrow', sans-serif !important;
-            }}
-            
-            .sidebar .sidebar-content {{
-                font-family: 'PfizerTomorrow', sans-serif;
-            }}
-            
-            .st-emotion-cache-1788y8l h1,
-            .st-emotion-cache-1788y8l h2,
-            .st-emotion-cache-1788y8l h3,
-            .st-emotion-cache-1788y8l h4 {{
-                font-family: 'PfizerTomorrow', sans-serif !important;
-            }}
-            
-            .custom-header {{
-                font-family: 'PfizerTomorrow', sans-serif !important;
-                font-weight: normal;
-            }}
-
-            .blue-header {{
-                color: #0000EE;
-                font-size: 24px;
-                margin-bottom: 20px;
-                text-align: center;
-            }}
-        </style>
-    """, unsafe_allow_html=True)
 
 # Initialize states
 if "messages" not in st.session_state:
@@ -147,6 +80,9 @@ if "messages" not in st.session_state:
 if "current_page" not in st.session_state:
     st.session_state.current_page = "Analysis"
 
+# Set in the sidebar when the dataset statistics wait on a background profile
+profile_pending = False
+
 # Sidebar layout
 with st.sidebar:
     # 2. CXI&AI Header
@@ -176,66 +112,69 @@ with st.sidebar:
     if selected_page == "Analysis":
         # File upload section
         st.markdown('<h2 class="custom-header">Upload Data</h2>', unsafe_allow_html=True)
-        uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+        uploaded_file = st.file_uploader(
+            "Choose a CSV, Parquet or Arrow file",
+            type=["csv", "parquet", "pq", "arrow", "feather", "ipc"]
+        )
         
         if uploaded_file is not None:
             # Load data if not already in session state or if new file
             if 'df' not in st.session_state or st.session_state.uploaded_file != uploaded_file:
-                st.session_state.df = pd.read_csv(uploaded_file)
+                # Identical uploads from any session share one parsed, read-only frame
+                progress_bar = st.progress(0.0, text=f"Reading {uploaded_file.name}...")
+                fingerprint, df = load_uploaded_dataframe(
+                    uploaded_file,
+                    progress=lambda fraction, message: progress_bar.progress(fraction, text=message)
+                )
+                progress_bar.empty()
+                st.session_state.df = df
+                st.session_state.dataset_fingerprint = fingerprint
                 st.session_state.uploaded_file = uploaded_file
                 
-                # Display data preview in sidebar
-                st.markdown('<h3 class="custom-header">Data Preview</h3>', unsafe_allow_html=True)
-                st.dataframe(st.session_state.df.head(), use_container_width=True)
-                
-                # Display basic statistics
-                st.markdown('<h3 class="custom-header">Data Statistics</h3>', unsafe_allow_html=True)
-                stats = {
-                    "Total Rows": len(st.session_state.df),
-                    "Total Columns": len(st.session_state.df.columns),
-                    "Missing Values": st.session_state.df.isnull().sum().sum(),
-                    "Duplicate Rows": st.session_state.df.duplicated().sum()
-                }
-                for metric, value in stats.items():
-                    st.metric(metric, value)
+            # Display data preview in sidebar
+            df = st.session_state.df
+            fingerprint = st.session_state.dataset_fingerprint
+            st.markdown('<h3 class="custom-header">Data Preview</h3>', unsafe_allow_html=True)
+            st.dataframe(df.head(), use_container_width=True)
+            
+            # Display basic statistics, approximate and cached per dataset unless exact is requested
+            st.markdown('<h3 class="custom-header">Data Statistics</h3>', unsafe_allow_html=True)
+            exact_stats = st.toggle("Exact statistics", key="exact_stats")
+            # Filled in again at the end of the run if a background profile is still being computed
+            profile_status = st.empty()
+            profile_box = st.empty()
+            profile_pending = show_profile(profile_box, profile_status, df, fingerprint, exact_stats)
         
-        # 6. PowerPoint download section if there are messages
-        if st.session_state.messages:
-            st.divider()
-            st.markdown('<h2 class="custom-header">Export Analysis</h2>', unsafe_allow_html=True)
-            if st.button("📥 Download PowerPoint", use_container_width=True):
-                with st.spinner("Creating PowerPoint presentation..."):
-                    try:
-                        pptx_path = create_presentation(st.session_state.messages)
-                        with open(pptx_path, "rb") as file:
-                            st.download_button(
-                                label="📊 Download Analysis",
-                                data=file,
-                                file_name="data_analysis.pptx",
-                                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                                use_container_width=True
-                            )
-                        # Clean up the temporary file
-                        os.remove(pptx_path)
-                    except Exception as e:
-                        st.error(f"Error creating presentation: {str(e)}")
+        # 6. PowerPoint download section, filled in after the chat so it includes the latest reply
+        export_section = st.container()
+run_timer.mark("sidebar")
 
 # Main content area
 if selected_page == "Analysis":
     if 'df' in st.session_state:
         # Display chat messages from history
-        for message in st.session_state.messages:
+        assistant_turns = sum(1 for message in st.session_state.messages if message["role"] == "assistant")
+        assistant_index = 0
+        for index, message in enumerate(st.session_state.messages):
             with st.chat_message(
                 message["role"],
-                avatar=os.path.join(current_dir, "assets", "pfe-icon.png") if message["role"] == "assistant" else None
+                avatar=assistant_avatar() if message["role"] == "assistant" else None
             ):
                 st.markdown(message["content"])
-                if "chart" in message and message["chart"]:
-                    if isinstance(message["chart"], list):
-                        for chart in message["chart"]:
-                            st.plotly_chart(chart, use_container_width=True)
-                    else:
-                        st.plotly_chart(message["chart"], use_container_width=True)
+                if message["role"] != "assistant":
+                    continue
+                assistant_index += 1
+                if not message.get("charts"):
+                    continue
+                # Figures are rebuilt from their specs, so older turns only pay for it when opened
+                recent = assistant_index > assistant_turns - CHAT_EXPANDED_TURNS
+                count = len(message["charts"])
+                if recent or st.toggle(f"Show {count} chart{'s' if count != 1 else ''}", key=f"show_charts_{index}"):
+                    figures = message_figures(message)
+                    for chart in figures:
+                        st.plotly_chart(chart, use_container_width=True)
+                    if not figures:
+                        st.caption("The data for this chart is no longer loaded.")
         
         # React to user input
         if prompt := st.chat_input("Ask questions about your data"):
@@ -245,45 +184,100 @@ if selected_page == "Analysis":
             # Add user message to chat history
             st.session_state.messages.append({"role": "user", "content": prompt})
 
-            # Get response from Mulesoft API
-            with st.chat_message(
-                "assistant",
-                avatar=os.path.join(current_dir, "assets", "pfe-icon.png")
-            ):
-                with st.spinner("Thinking..."):
-                    response, charts = chat_with_data(prompt, st.session_state.df)
-                    st.markdown(response)
-                    if charts:
-                        if isinstance(charts, list):
+            # Each stage of the turn is timed; the timings go with the turn's log entry
+            with trace() as turn, span("turn"):
+                # Get response from Mulesoft API
+                with st.chat_message(
+                    "assistant",
+                    avatar=assistant_avatar()
+                ):
+                    fingerprint = st.session_state.get("dataset_fingerprint")
+                    if STREAM_RESPONSES:
+                        # Render text as it arrives and each chart as soon as its JSON block closes
+                        text_placeholder = st.empty()
+                        text_placeholder.markdown("Thinking...")
+                        response = ""
+                        charts = []
+                        for kind, value in stream_chat_with_data(
+                            prompt, st.session_state.df, fingerprint,
+                            on_wait=lambda position: text_placeholder.markdown(
+                                f"Waiting for the assistant, you are number {position} in the queue...")
+                        ):
+                            if kind == "text":
+                                response += value
+                                text_placeholder.markdown(response + "▌")
+                            elif kind == "chart":
+                                figure = render_chart(value, st.session_state.df, fingerprint)
+                                with span("plotly_chart"):
+                                    st.plotly_chart(figure, use_container_width=True)
+                                charts.append(value)
+                            elif kind == "done":
+                                response = value
+                        text_placeholder.markdown(response)
+                    else:
+                        queue_placeholder = st.empty()
+                        with st.spinner("Thinking..."):
+                            response, charts = chat_with_data(
+                                prompt, st.session_state.df, fingerprint,
+                                on_wait=lambda position: queue_placeholder.caption(
+                                    f"Waiting for the assistant, you are number {position} in the queue...")
+                            )
+                            queue_placeholder.empty()
+                            st.markdown(response)
                             for chart in charts:
-                                st.plotly_chart(chart, use_container_width=True)
-                        else:
-                            st.plotly_chart(charts, use_container_width=True)
+                                figure = render_chart(chart, st.session_state.df, fingerprint)
+                                with span("plotly_chart"):
+                                    st.plotly_chart(figure, use_container_width=True)
+            log_store.set_spans(turn.log_id, turn.spans)
+            latency_stats.write_metrics_file()
             
-            # Add assistant response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": response, "chart": charts})
+            # History keeps the compact chart specs; figures are rebuilt on demand from the dataset
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": response,
+                "charts": charts,
+                "fingerprint": fingerprint
+            })
 elif selected_page == "Logs":
-    st.title("LLM Interaction Logs")
-    
-    if "llm_logs" in st.session_state and st.session_state.llm_logs:
-        # Add clear logs button
-        if st.button("🗑️ Clear Logs", use_container_width=True):
-            st.session_state.llm_logs = []
-            st.rerun()
-        
-        # Display logs in reverse chronological order
-        for log in reversed(st.session_state.llm_logs):
-            with st.expander(f"🕒 {log['timestamp']} - {log['prompt'][:50]}..."):
-                st.markdown("### 🗣️ User Prompt")
-                st.code(log['prompt'], language="markdown")
-                
-                st.markdown("### 🤖 Assistant Response")
-                st.code(log['response'], language="markdown")
-                
-                if log.get('chart_specs'):
-                    st.markdown("### 📊 Chart Specifications")
-                    st.json(log['chart_specs'])
-                
-                st.divider()
-    else:
-        st.info("No logs available yet. Start chatting with your data to see the interaction logs!")
\ No newline at end of file
+    show_logs()
+
+run_timer.mark("page")
+
+# The deck is built incrementally per session: only messages added since the last run get new slides
+if selected_page == "Analysis" and st.session_state.messages:
+    with export_section:
+        st.divider()
+        st.markdown('<h2 class="custom-header">Export Analysis</h2>', unsafe_allow_html=True)
+        draft_export = st.toggle("Draft quality images (faster)", key="draft_export")
+        preset = "draft" if draft_export else EXPORT_IMAGE_PRESET
+        builder = st.session_state.get("presentation_builder")
+        if builder is None or builder.preset != preset or builder.message_count > len(st.session_state.messages):
+            # History keeps chart specs, so the builder rebuilds figures from them
+            builder = PresentationBuilder(preset, figures_for=message_figures)
+            st.session_state.presentation_builder = builder
+        try:
+            if builder.message_count < len(st.session_state.messages):
+                with st.spinner("Adding the latest analysis to the presentation..."):
+                    builder.update(st.session_state.messages)
+            st.download_button(
+                label="📥 Download PowerPoint",
+                data=builder.to_bytes(),
+                file_name="data_analysis.pptx",
+                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+                use_container_width=True
+            )
+        except Exception as e:
+            st.error(f"Error creating presentation: {str(e)}")
+    run_timer.mark("export")
+run_timings.finish(run_timer)
+
+# Once the page is drawn, wait for the background profile and redraw only the statistics when it lands.
+# The status caption is rewritten while waiting, so a rerun requested meanwhile interrupts the wait.
+if profile_pending:
+    exact = bool(st.session_state.get("exact_stats"))
+    waited = 0.0
+    while profile_cache.wait(st.session_state.dataset_fingerprint, exact, PROFILE_POLL_SECONDS):
+        waited += PROFILE_POLL_SECONDS
+        profile_status.caption(f"Computing {'exact statistics' if exact else 'distinct values and duplicates'}... "
+                               f"({waited:.0f}s)")
+    show_profile(profile_box, profile_status, st.session_state.df, st.session_state.dataset_fingerprint, exact)
@@ -0,0 +1,203 @@
+from collections import namedtuple
+import json
+import re
+
+CHART_TYPES = {"bar", "line", "scatter", "pie", "word_cloud", "top_terms"}
+
+# A chart specification found in the response text, with its [start, end) offsets
+ExtractedSpec = namedtuple("ExtractedSpec", ["spec", "start", "end"])
+
+# Characters that matter while walking an object that hasn't fully arrived yet
+_OBJECT_TOKENS = re.compile(r'[{}"]')
+_STRING_TOKENS = re.compile(r'["\\]')
+
+
+def is_chart_spec(obj):
+    """Check that a decoded JSON value looks like a chart specification"""
+    if not isinstance(obj, dict) or obj.get("chart_type") not in CHART_TYPES:
+        return False
+    if obj["chart_type"] in ("word_cloud", "top_terms"):
+        required_fields = ["text_column", "title"]
+    else:
+        required_fields = ["x_column", "y_column", "title"]
+    return all(isinstance(obj.get(field), str) for field in required_fields)
+
+
+class ChartSpecExtractor:
+    """Finds chart specification JSON objects in LLM output, one chunk at a time
+
+    Complete objects are decoded directly with JSONDecoder.raw_decode, and
+    objects that are cut off at the end of a chunk are walked with a small
+    brace/string state machine that resumes where it stopped when the next
+    chunk arrives. A brace that turns out not to open JSON is treated as
+    plain text and scanning resumes just after it. Text that can no longer
+    contain a spec is dropped, so the buffer only holds the unresolved tail.
+    """
+
+    def __init__(self, validate=is_chart_spec):
+        self.validate = validate
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._base = 0      # Absolute offset of self._buf[0] in the full text
+        self._pos = 0       # Scan position within self._buf
+        self._start = None  # Buffer offset of an object that hasn't closed yet
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, chunk):
+        """Add a chunk of text and return the specs that completed in it"""
+        drop = self._pos if self._start is None else self._start
+        if drop:
+            self._buf = self._buf[drop:]
+            self._base += drop
+            self._pos -= drop
+            if self._start is not None:
+                self._start -= drop
+        self._buf += chunk
+        return list(self._scan())
+
+    def finish(self):
+        """Signal the end of the text and return any specs still pending
+
+        An opening brace that never closed is treated as plain text, and
+        scanning resumes right after it.
+        """
+        found = []
+        while self._start is not None:
+            self._pos = self._start + 1
+            self._reset_candidate()
+            found.extend(self._scan())
+        return found
+
+    def _reset_candidate(self):
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+
+    def _scan(self):
+        buf = self._buf
+        while True:
+            if self._start is None:
+                idx = buf.find("{", self._pos)
+                if idx == -1:
+                    self._pos = len(buf)
+                    return
+                try:
+                    obj, end = self._decoder.raw_decode(buf, idx)
+                except json.JSONDecodeError:
+                    # Either cut off by the chunk boundary or not JSON at all
+                    self._start = idx
+                    self._pos = idx
+                else:
+                    self._pos = end
+                    if self.validate(obj):
+                        yield ExtractedSpec(obj, self._base + idx, self._base + end)
+                    continue
+
+            if not self._walk():
+                # Object is still open, wait for more text
+                return
+
+            # Braces balanced now that more text arrived, try decoding again
+            start, end = self._start, self._pos
+            self._reset_candidate()
+            try:
+                obj, decoded_end = self._decoder.raw_decode(buf, start)
+            except json.JSONDecodeError:
+                # Not JSON after all: treat the brace as plain text, as finish() does,
+                # so a spec nested inside it is still found
+                self._pos = start + 1
+                continue
+            if decoded_end == end and self.validate(obj):
+                yield ExtractedSpec(obj, self._base + start, self._base + end)
+
+    def _walk(self):
+        """Advance through the open object; return True once its braces balance"""
+        buf = self._buf
+        pos = self._pos
+        while True:
+            if self._in_string:
+                match = _STRING_TOKENS.search(buf, pos)
+                if match is None:
+                    self._pos = len(buf)
+                    return False
+                if match.group() == "\\":
+                    if match.end() >= len(buf):
+                        # Escape sequence split across chunks
+                        self._pos = match.start()
+                        return False
+                    pos = match.end() + 1
+                else:
+                    self._in_string = False
+                    pos = match.end()
+            else:
+                match = _OBJECT_TOKENS.search(buf, pos)
+                if match is None:
+                    self._pos = len(buf)
+                    return False
+                token = match.group()
+                pos = match.end()
+                if token == '"':
+                    self._in_string = True
+                elif token == "{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._pos = pos
+                        return True
+
+
+def extract_chart_specs(text, validate=is_chart_spec):
+    """Return every chart specification found in a complete response text"""
+    extractor = ChartSpecExtractor(validate)
+    return extractor.feed(text) + extractor.finish()
+
+
+if __name__ == "__main__":
+    # Micro-benchmark against the old find/brace-count/slice loop
+    import timeit
+
+    def brace_scan(text):
+        specs = []
+        while True:
+            start_idx = text.find("{")
+            if start_idx == -1:
+                break
+            brace_count = 1
+            end_idx = start_idx + 1
+            while brace_count > 0 and end_idx < len(text):
+                if text[end_idx] == '{':
+                    brace_count += 1
+                elif text[end_idx] == '}':
+                    brace_count -= 1
+                end_idx += 1
+            if brace_count != 0:
+                break
+            try:
+                specs.append(json.loads(text[start_idx:end_idx]))
+            except json.JSONDecodeError:
+                pass
+            text = text[end_idx:]
+        return specs
+
+    spec = {"chart_type": "bar", "x_column": "country", "y_column": "count", "title": "Count by Country"}
+    paragraph = "The distribution is skewed towards a handful of markets. " * 8
+    for n_specs in (10, 100, 500):
+        text = "".join(f"{paragraph}\n{json.dumps(spec)}\n" for _ in range(n_specs))
+        chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+
+        def streamed():
+            extractor = ChartSpecExtractor()
+            for chunk in chunks:
+                extractor.feed(chunk)
+            extractor.finish()
+
+        assert len(extract_chart_specs(text)) == len(brace_scan(text)) == n_specs
+        runs = 20
+        old = timeit.timeit(lambda: brace_scan(text), number=runs) / runs
+        new = timeit.timeit(lambda: extract_chart_specs(text), number=runs) / runs
+        stream = timeit.timeit(streamed, number=runs) / runs
+        print(f"{len(text) / 1024:8.1f} KB, {n_specs:4d} specs: "
+              f"brace scan {old * 1000:8.2f} ms | extractor {new * 1000:6.2f} ms | "
+              f"64-char chunks {stream * 1000:6.2f} ms")
@@ -1,13 +1,24 @@
 from utils import generate_chart
+from chart_extractor import ChartSpecExtractor, extract_chart_specs, is_chart_spec
+from aggregation import cached_aggregate, normalize_aggregation, value_column
+from query_engine import QueryError, format_result, is_query_spec, run_query
+from gateway import token_manager, post_to_gateway, stream_from_gateway
+from prompt_context import get_dataset_context
+from text_index import token_index_for
+from data_store import dataframe_cache
+from lru import LRUCache
+from response_cache import RESPONSE_CACHE_ENABLED, response_cache, response_key
+from log_store import log_store
+from latency import current_trace, latency_stats, span
 from dotenv import load_dotenv
 import logging
-from datetime import datetime
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 import re  # Add this import for text cleaning
-import requests  # Add this import
 import os  # Add this import
 import json  # Add this import
+import time
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -16,20 +27,16 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Figures rebuilt from chart specs are shared by every session of the process
+FIGURE_CACHE_SIZE = int(os.getenv('FIGURE_CACHE_SIZE', '64'))
+
+_figure_cache = LRUCache(FIGURE_CACHE_SIZE)  # "fingerprint:spec" -> figure or None
+_MISSING = object()
+
 def get_oauth_token():
     """Get OAuth token for Mulesoft API"""
     try:
-        response = requests.post(
-            os.getenv('OAUTH_TOKEN_URL'),
-            headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            data={
-                'grant_type': 'client_credentials',
-                'client_id': os.getenv('OAUTH_CLIENT_ID'),
-                'client_secret': os.getenv('OAUTH_CLIENT_SECRET')
-            }
-        )
-        response.raise_for_status()
-        return response.json()['access_token']
+        return token_manager.get_token()
     except Exception as e:
         logger.error(f"Error getting OAuth token: {str(e)}")
         raise
@@ -62,29 +69,15 @@ def get_data_overview(df):
     Please provide a concise summary that explains the nature of the dataset and its potential use cases."""
     
     try:
-        # Get OAuth token
-        access_token = get_oauth_token()
-
         # Prepare messages for Mulesoft API
         messages = [{"role": "user", "content": prompt}]
         
         # Make request to Mulesoft API
-        response = requests.post(
-            os.getenv('MULESOFT_API_URL'),
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-                'Accept': '*/*'
-            },
-            json={
-                "model": "anthropic.claude-3-5-sonnet-20240620-v1:0",
-                "max_tokens": 500,
-                "messages": messages
-            }
-        )
-        response.raise_for_status()
-        
-        result = response.json()
+        result = post_to_gateway({
+            "model": "anthropic.claude-3-5-sonnet-20240620-v1:0",
+            "max_tokens": 500,
+            "messages": messages
+        })
         response_text = result.get('result', '')
         
         # Log the interaction
@@ -96,28 +89,26 @@ def get_data_overview(df):
         logger.error(error_msg)
         return error_msg
 
-def log_interaction(prompt, response, chart_specs=None):
-    """Log interaction with the LLM"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "prompt": prompt,
-        "response": clean_response(response),  # Clean the response in logs too
-        "chart_specs": chart_specs
-    }
-    if "llm_logs" not in st.session_state:
-        st.session_state.llm_logs = []
-    st.session_state.llm_logs.append(log_entry)
+def log_interaction(prompt, response, chart_specs=None, cache=None):
+    """Log interaction with the LLM to the persistent log store, with the turn's stage timings so far"""
+    trace = current_trace()
+    entry_id = log_store.append(
+        prompt,
+        clean_response(response),  # Clean the response in logs too
+        chart_specs,
+        cache,
+        current_session_id(),
+        spans=dict(trace.spans) if trace is not None else None
+    )
+    if trace is not None:
+        # Stages that finish after logging (e.g. drawing the charts) are added to this entry later
+        trace.log_id = entry_id
 
-def chat_with_data(prompt, df):
-    """Handle chat interactions with the dataset"""
-    # Initialize llm_logs in session state if it doesn't exist
-    if "llm_logs" not in st.session_state:
-        st.session_state.llm_logs = []
-        
-    # First, create case-insensitive column mapping
-    column_map = {col.lower(): col for col in df.columns}
-    
+def build_chat_payload(prompt, df, fingerprint=None):
+    """Build the Mulesoft API payload for a chat turn"""
+    # The dataset summary is built once per fingerprint, so the system message is
+    # byte-identical across turns and the gateway can cache the prompt prefix
+    dataset_context = get_dataset_context(df, fingerprint)
     system_prompt = f"""You are a data analysis assistant that helps analyze data and create visualizations.
     
     When creating visualizations, you MUST return a JSON object in your response using this exact format:
@@ -126,174 +117,371 @@ def chat_with_data(prompt, df):
     For word clouds, use this format instead:
     {{"chart_type": "word_cloud", "text_column": "column_name", "title": "chart_title"}}
     
+    For the most frequent words in a text column as a bar chart, use:
+    {{"chart_type": "top_terms", "text_column": "column_name", "top_n": 20, "ngram": 1, "title": "chart_title"}}
+    Use "ngram": 2 for the most frequent word pairs. Word clouds and top_terms charts can be limited to the rows
+    where another column has a given value with "filter_column": "column_name" and "filter_value": value.
+    
     Available chart types are:
     - "bar" for bar charts (good for categorical comparisons or counts)
     - "line" for line charts (good for trends over time)
     - "scatter" for scatter plots (good for relationship between variables)
     - "pie" for pie charts (good for showing proportions)
     - "word_cloud" for text analysis (good for visualizing frequent terms in text)
+    - "top_terms" for ranking the most frequent words or word pairs in text
     
     Example responses:
     1. For a value-based chart: {{"chart_type": "bar", "x_column": "country", "y_column": "value", "title": "Values by Country"}}
     2. For a count-based chart: {{"chart_type": "bar", "x_column": "country", "y_column": "count", "title": "Count by Country"}}
     3. For a word cloud: {{"chart_type": "word_cloud", "text_column": "comments", "title": "Word Cloud of Comments"}}
     
-    Column names are case-sensitive, here are the exact column names:
-    {df.columns.tolist()}"""
+    Optional fields to aggregate the data before plotting:
+    - "agg": "sum"|"mean"|"median"|"count"|"nunique" to aggregate y_column for each x_column value
+    - "group_by": "column_name" to draw one series per value of that column
+    - "time_bucket": "hour"|"day"|"week"|"month"|"quarter"|"year" to group a date x_column into periods
+    - "top_n": a number to keep only the N largest x_column values (pie charts fold the rest into "Other")
+    4. For an aggregated chart: {{"chart_type": "bar", "x_column": "country", "y_column": "revenue", "agg": "sum", "top_n": 10, "title": "Top 10 Countries by Revenue"}}
+    5. For a trend: {{"chart_type": "line", "x_column": "order_date", "y_column": "revenue", "agg": "sum", "time_bucket": "month", "group_by": "region", "title": "Monthly Revenue by Region"}}
+    
+    When the question needs exact numbers (totals, averages, rankings, counts), do not estimate them from the sample.
+    Return a query object instead and the result table will be computed and shown to the user below your reply:
+    {{"query": "SELECT ... FROM data ...", "title": "query_title"}}
+    The dataset is the table "data" and the query must be a single read-only DuckDB SELECT statement.
+    To chart the query result as well, add "chart_type", "x_column" and "y_column" using the result's column names.
+    6. For a computed answer: {{"query": "SELECT country, SUM(revenue) AS total_revenue FROM data GROUP BY country ORDER BY total_revenue DESC LIMIT 10", "chart_type": "bar", "x_column": "country", "y_column": "total_revenue", "title": "Top 10 Countries by Revenue"}}
+    7. For frequent terms in some rows: {{"chart_type": "top_terms", "text_column": "comments", "top_n": 15, "filter_column": "rating", "filter_value": 1, "title": "Top Terms in 1-Star Comments"}}
+    
+    Column names are case-sensitive, use them exactly as listed below.
     
-    # Provide more context about the data
-    data_context = f"""Available columns in the dataset: {df.columns.tolist()}
-    Data shape: {df.shape}
-    Sample data:
-    {df.head().to_string()}
+{dataset_context}"""
+    
+    return {
+        "model": "anthropic.claude-3-sonnet-v1:0",
+        "max_tokens": 1000,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"User request: {prompt}"}
+        ]
+    }
+
+def current_session_id():
+    """Id of the Streamlit session running this script, used to queue gateway calls fairly"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def chat_cache_key(prompt, payload, fingerprint):
+    """Response cache key for a chat turn, or None when the turn should not be cached"""
+    if not RESPONSE_CACHE_ENABLED or fingerprint is None:
+        return None
+    return response_key(fingerprint, payload["model"], prompt, payload["messages"][0]["content"])
+
+def text_filter(chart_specs, column_map):
+    """The optional (column, value) row filter of a text chart spec, or None"""
+    filter_column = chart_specs.get("filter_column")
+    filter_value = chart_specs.get("filter_value")
+    if not isinstance(filter_column, str) or filter_column.lower() not in column_map:
+        return None
+    if not isinstance(filter_value, (str, int, float)) or isinstance(filter_value, bool):
+        return None
+    return column_map[filter_column.lower()], filter_value
+
+def top_terms_chart(chart_specs, df, text_column, fingerprint=None, row_filter=None):
+    """Bar chart of the most frequent words (or word pairs) in a text column"""
+    top_n = chart_specs.get("top_n")
+    top_n = int(top_n) if isinstance(top_n, (int, float)) and not isinstance(top_n, bool) and top_n > 0 else 20
+    ngram = 2 if chart_specs.get("ngram") == 2 else 1
+    terms = token_index_for(df, text_column, fingerprint, row_filter).top_terms(top_n, ngram)
+    return generate_chart(terms, "bar", x_column="term", y_column="count", title=chart_specs["title"])
+
+def build_chart(chart_specs, df, column_map, fingerprint=None):
+    """Turn one chart specification from the LLM into a figure, or None if it doesn't fit the data
+
+    df may be a DataFrame or a ColumnarDataset; either way only the columns
+    referenced by the spec are pulled out before plotting. Aggregated results
+    are cached per dataset fingerprint when one is given.
     """
+    # Handle text charts separately, both read the column's token index
+    if chart_specs.get("chart_type") in ("word_cloud", "top_terms"):
+        if "text_column" in chart_specs:
+            text_col = chart_specs["text_column"].lower()
+            if text_col in column_map:
+                actual_text_col = column_map[text_col]
+                row_filter = text_filter(chart_specs, column_map)
+                if chart_specs["chart_type"] == "top_terms":
+                    return top_terms_chart(chart_specs, df, actual_text_col, fingerprint, row_filter)
+                return generate_chart(
+                    df,
+                    "word_cloud",
+                    text_column=actual_text_col,
+                    title=chart_specs["title"],
+                    fingerprint=fingerprint,
+                    row_filter=row_filter
+                )
+        return None
+    
+    # Validate required fields
+    required_fields = ["chart_type", "x_column", "y_column", "title"]
+    if not all(field in chart_specs for field in required_fields):
+        return None
     
+    # Try to match column names case-insensitively
+    x_col = chart_specs["x_column"].lower()
+    if x_col not in column_map:
+        return None
+    actual_x_col = column_map[x_col]
+    
+    # Count-based charts have no y column of their own
+    if chart_specs["y_column"] == "count":
+        actual_y_col = None
+    else:
+        y_col = chart_specs["y_column"].lower()
+        if y_col not in column_map:
+            return None
+        actual_y_col = column_map[y_col]
+    
+    group_by = chart_specs.get("group_by")
+    actual_group_col = column_map.get(group_by.lower()) if isinstance(group_by, str) else None
+    if actual_group_col in (actual_x_col, actual_y_col):
+        actual_group_col = None
+    
+    # Aggregate server-side when the spec asks for it, so the chart plots groups instead of raw rows
+    aggregation = normalize_aggregation(chart_specs, actual_x_col, actual_y_col, actual_group_col)
+    if aggregation is not None:
+        try:
+            plot_df = cached_aggregate(df, aggregation, fingerprint)
+        except Exception as e:
+            # One bad spec (e.g. a mean of a text column) shouldn't drop the other charts
+            logger.error(f"Error aggregating chart data: {str(e)}")
+            return None
+        plot_y_col = value_column(aggregation)
+    else:
+        # Only load the columns this chart plots
+        plot_df = df[list(dict.fromkeys(col for col in (actual_x_col, actual_y_col, actual_group_col) if col is not None))]
+        plot_y_col = actual_y_col
+    
+    return generate_chart(
+        plot_df,
+        chart_specs["chart_type"],
+        actual_x_col,
+        plot_y_col,
+        chart_specs["title"],
+        color_column=actual_group_col
+    )
+
+def is_response_spec(obj):
+    """Chart specifications and query requests are both picked out of LLM responses"""
+    return is_chart_spec(obj) or is_query_spec(obj)
+
+def _build_from_spec(spec, df, fingerprint=None):
+    if not is_query_spec(spec):
+        return build_chart(spec, df, {col.lower(): col for col in df.columns}, fingerprint)
     try:
-        # Make request to Mulesoft API
-        access_token = get_oauth_token()
-        
-        response = requests.post(
-            os.getenv('MULESOFT_API_URL'),
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-                'Accept': '*/*'
-            },
-            json={
-                "model": "anthropic.claude-3-sonnet-v1:0",
-                "max_tokens": 1000,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"{data_context}\n\nUser request: {prompt}"}
-                ]
-            }
+        result, _ = run_query(spec["query"], df)
+    except QueryError as e:
+        logger.error(f"Query failed: {str(e)}")
+        return None
+    return build_chart(spec, result, {col.lower(): col for col in result.columns})
+
+def render_chart(spec, df, fingerprint=None, build=None):
+    """Return the figure for a chart spec, memoized per dataset fingerprint
+
+    Chat history keeps only specs, so past charts are rebuilt through this
+    on every rerun; with a fingerprint the figure is built once per process.
+    build overrides how a missing figure is made.
+    """
+    if build is None:
+        build = lambda: _build_from_spec(spec, df, fingerprint)
+    if fingerprint is None:
+        with span("generate_chart"):
+            return build()
+    key = f"{fingerprint}:{json.dumps(spec, sort_keys=True, default=str)}"
+    figure = _figure_cache.get(key, _MISSING)
+    if figure is not _MISSING:
+        return figure
+    with span("generate_chart"):
+        figure = build()
+    _figure_cache.put(key, figure)
+    return figure
+
+def history_dataset(fingerprint):
+    """The dataset a past chat turn was answered from, or None if it is no longer loaded"""
+    if fingerprint is None or fingerprint == st.session_state.get("dataset_fingerprint"):
+        return st.session_state.get("df")
+    return dataframe_cache.get(fingerprint)
+
+def message_figures(message):
+    """Rebuild the figures for a chat history entry from its stored chart specs"""
+    df = history_dataset(message.get("fingerprint"))
+    if df is None:
+        return []
+    figures = (render_chart(spec, df, message.get("fingerprint")) for spec in message.get("charts") or [])
+    return [figure for figure in figures if figure is not None]
+
+def handle_spec(spec, df, column_map, fingerprint=None):
+    """Act on one spec from the response and return (text_to_append, chart)
+
+    Query requests are run locally and their result table is appended to the
+    response; if the spec also names a chart, it is drawn from the result.
+    """
+    if not is_query_spec(spec):
+        return "", render_chart(spec, df, fingerprint, lambda: build_chart(spec, df, column_map, fingerprint))
+    try:
+        with span("query"):
+            result, truncated = run_query(spec["query"], df)
+    except QueryError as e:
+        logger.error(f"Query failed: {str(e)}")
+        return f"\n\nQuery failed: {str(e)}", None
+    chart = None
+    if is_chart_spec(spec):
+        chart = render_chart(
+            spec, df, fingerprint, lambda: build_chart(spec, result, {col.lower(): col for col in result.columns})
         )
-        response.raise_for_status()
-        result = response.json()
-        response_text = result.get('result', '')
-        
-        response_text = clean_response(response_text)
+    return format_result(result, truncated), chart
+
+def chat_with_data(prompt, df, fingerprint=None, on_wait=None):
+    """Handle chat interactions with the dataset and return (response_text, chart_specs)
+
+    chart_specs lists the specs that produced a chart; their figures come
+    from render_chart. on_wait(position) is called with the caller's queue
+    position while the gateway is busy with other requests.
+    """
+    # First, create case-insensitive column mapping
+    column_map = {col.lower(): col for col in df.columns}
+    
+    try:
+        with span("build_prompt"):
+            payload = build_chat_payload(prompt, df, fingerprint)
+        cache_key = chat_cache_key(prompt, payload, fingerprint)
+        # Repeated questions about the same dataset are answered from the cache
+        response_text, cache_status = response_cache.get(cache_key) if cache_key else (None, None)
+        if response_text is None:
+            # Make request to Mulesoft API
+            with span("gateway"):
+                result = post_to_gateway(payload, current_session_id(), on_wait)
+            response_text = result.get('result', '')
+            response_text = clean_response(response_text)
+        llm_text = response_text
         chart = None
         chart_specs = None
         
         # Process charts and get final response
         try:
-            # Look for all JSON objects in the response
+            # Look for all chart specifications and queries in the response
             charts = []
-            response_text_clean = response_text
-            
-            while True:
-                start_idx = response_text_clean.find("{")
-                if start_idx == -1:
-                    break
-                    
-                # Find the matching closing brace
-                brace_count = 1
-                end_idx = start_idx + 1
-                
-                while brace_count > 0 and end_idx < len(response_text_clean):
-                    if response_text_clean[end_idx] == '{':
-                        brace_count += 1
-                    elif response_text_clean[end_idx] == '}':
-                        brace_count -= 1
-                    end_idx += 1
-                
-                if brace_count == 0:
-                    json_str = response_text_clean[start_idx:end_idx]
-                    try:
-                        chart_specs = json.loads(json_str)
-                        
-                        # Handle word cloud separately
-                        if chart_specs.get("chart_type") == "word_cloud":
-                            if "text_column" in chart_specs:
-                                text_col = chart_specs["text_column"].lower()
-                                if text_col in column_map:
-                                    actual_text_col = column_map[text_col]
-                                    chart = generate_chart(
-                                        df,
-                                        "word_cloud",
-                                        text_column=actual_text_col,
-                                        title=chart_specs["title"]
-                                    )
-                                    charts.append(chart)
-                        else:
-                            # Validate required fields
-                            required_fields = ["chart_type", "x_column", "y_column", "title"]
-                            if all(field in chart_specs for field in required_fields):
-                                # Try to match column names case-insensitively
-                                x_col = chart_specs["x_column"].lower()
-                                if x_col in column_map:
-                                    actual_x_col = column_map[x_col]
-                                    
-                                    # Handle count-based charts
-                                    if chart_specs["y_column"] == "count":
-                                        # Create a count-based DataFrame
-                                        count_df = df[actual_x_col].value_counts().reset_index()
-                                        count_df.columns = [actual_x_col, 'count']
-                                        chart = generate_chart(
-                                            count_df,
-                                            chart_specs["chart_type"],
-                                            actual_x_col,
-                                            'count',
-                                            chart_specs["title"]
-                                        )
-                                        charts.append(chart)
-                                    else:
-                                        # Handle regular charts with actual y-column
-                                        y_col = chart_specs["y_column"].lower()
-                                        if y_col in column_map:
-                                            actual_y_col = column_map[y_col]
-                                            chart = generate_chart(
-                                                df,
-                                                chart_specs["chart_type"],
-                                                actual_x_col,
-                                                actual_y_col,
-                                                chart_specs["title"]
-                                            )
-                                            charts.append(chart)
-                    except json.JSONDecodeError:
-                        continue
-                    
-                    # Remove the processed JSON from the text
-                    response_text_clean = response_text_clean[end_idx:]
-                else:
-                    break
+            query_results = []
+            with span("extraction"):
+                found = extract_chart_specs(response_text, is_response_spec)
+            for extracted in found:
+                chart_specs = extracted.spec
+                extra_text, chart = handle_spec(chart_specs, df, column_map, fingerprint)
+                if extra_text:
+                    query_results.append(extra_text)
+                if chart is not None:
+                    charts.append(chart_specs)
+            response_text += "".join(query_results)
+            if cache_status == "miss" and llm_text:
+                # Store the model's text only; charts and query results are rebuilt from its specs
+                response_cache.put(cache_key, llm_text, fingerprint, payload["model"], prompt)
             
             # Log the interaction
-            log_entry = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "prompt": prompt,
-                "response": response_text,
-                "chart_specs": chart_specs
-            }
-            st.session_state.llm_logs.append(log_entry)
+            log_interaction(prompt, response_text, chart_specs, cache_status)
             
-            # Return the response and charts
-            if charts:
-                return response_text, charts[0] if len(charts) == 1 else charts
-            return response_text, None
+            return response_text, charts
             
         except Exception as e:
             error_msg = f"\n\nError generating chart: {str(e)}"
             # Log error interaction
-            log_entry = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "prompt": prompt,
-                "response": response_text + error_msg,
-                "chart_specs": None
-            }
-            st.session_state.llm_logs.append(log_entry)
-            return response_text + error_msg, None
+            log_interaction(prompt, response_text + error_msg, cache=cache_status)
+            return response_text + error_msg, []
         
     except Exception as e:
         error_msg = f"Error communicating with Mulesoft API: {str(e)}"
         logger.error(error_msg)
         # Log error interaction
-        log_entry = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "prompt": prompt,
-            "response": error_msg,
-            "chart_specs": None
-        }
-        st.session_state.llm_logs.append(log_entry)
-        return error_msg, None
\ No newline at end of file
+        log_interaction(prompt, error_msg)
+        return error_msg, []
+
+def stream_chat_with_data(prompt, df, fingerprint=None, on_wait=None):
+    """Stream a chat turn, yielding ("text", delta) and ("chart", spec) events as they arrive
+
+    The last event is ("done", response_text) with the cleaned full response.
+    Chart JSON blocks are built as soon as their closing brace has been
+    received and reported once their figure is ready in render_chart.
+    on_wait works as in chat_with_data.
+    """
+    column_map = {col.lower(): col for col in df.columns}
+    response_text = ""
+    chart_specs = None
+    extractor = ChartSpecExtractor(is_response_spec)
+    
+    def charts_from(found):
+        nonlocal chart_specs, response_text
+        for extracted in found:
+            chart_specs = extracted.spec
+            try:
+                extra_text, chart = handle_spec(chart_specs, df, column_map, fingerprint)
+            except Exception as e:
+                logger.error(f"Error generating chart: {str(e)}")
+                extra_text, chart = "", None
+            if extra_text:
+                response_text += extra_text
+                yield "text", extra_text
+            if chart is not None:
+                yield "chart", chart_specs
+    
+    try:
+        with span("build_prompt"):
+            payload = build_chat_payload(prompt, df, fingerprint)
+        cache_key = chat_cache_key(prompt, payload, fingerprint)
+        cached_text, cache_status = response_cache.get(cache_key) if cache_key else (None, None)
+        if cached_text is not None:
+            response_text = cached_text
+            yield "text", cached_text
+            with span("extraction"):
+                found = extract_chart_specs(cached_text, is_response_spec)
+            yield from charts_from(found)
+            log_interaction(prompt, response_text, chart_specs, cache_status)
+            yield "done", clean_response(response_text)
+            return
+        
+        llm_text = ""
+        # Only time spent waiting on the gateway counts, not the caller drawing what was yielded
+        gateway_seconds = extraction_seconds = 0.0
+        waiting_since = time.perf_counter()
+        try:
+            for delta in stream_from_gateway(payload, current_session_id(), on_wait):
+                if not llm_text:
+                    latency_stats.record("gateway_first_token", time.perf_counter() - waiting_since)
+                gateway_seconds += time.perf_counter() - waiting_since
+                response_text += delta
+                llm_text += delta
+                yield "text", delta
+                # Charts are built as soon as their JSON object closes
+                extract_start = time.perf_counter()
+                found = extractor.feed(delta)
+                extraction_seconds += time.perf_counter() - extract_start
+                yield from charts_from(found)
+                waiting_since = time.perf_counter()
+            gateway_seconds += time.perf_counter() - waiting_since
+        finally:
+            latency_stats.record("gateway", gateway_seconds)
+        extract_start = time.perf_counter()
+        found = extractor.finish()
+        latency_stats.record("extraction", extraction_seconds + time.perf_counter() - extract_start)
+        yield from charts_from(found)
+        
+        llm_text = clean_response(llm_text)
+        if cache_key and llm_text:
+            response_cache.put(cache_key, llm_text, fingerprint, payload["model"], prompt)
+        response_text = clean_response(response_text)
+        log_interaction(prompt, response_text, chart_specs, cache_status)
+        yield "done", response_text
+        
+    except Exception as e:
+        error_msg = f"Error communicating with Mulesoft API: {str(e)}"
+        logger.error(error_msg)
+        if response_text:
+            error_msg = f"\n\n{error_msg}"
+        log_interaction(prompt, response_text + error_msg)
+        yield "text", error_msg
+        yield "done", response_text + error_msg
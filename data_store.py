@@ -0,0 +1,118 @@
+from lru import LRUCache
+from ingest import ColumnarDataset, is_columnar_upload, open_columnar_upload, read_csv_optimized
+from latency import span
+import pandas as pd
+import threading
+import logging
+import hashlib
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Frames in the cache are shared between sessions, so any write made through
+# a derived frame must copy instead of touching the shared data
+pd.set_option("mode.copy_on_write", True)
+
+DATAFRAME_CACHE_MB = float(os.getenv('DATAFRAME_CACHE_MB', '2048'))
+
+
+def fingerprint_bytes(data):
+    """Return a content hash identifying an uploaded dataset"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fingerprint_upload(uploaded_file):
+    """Fingerprint a Streamlit UploadedFile without consuming its read position"""
+    return fingerprint_bytes(uploaded_file.getvalue())
+
+
+def frame_nbytes(df):
+    """Approximate in-memory size of a dataframe, including object column payloads
+
+    Columns of a frame spilled to disk are memory-mapped, so only the
+    category labels kept in memory count towards its size.
+    """
+    if isinstance(df, ColumnarDataset):
+        # Memory-mapped from local disk, loaded a few columns at a time
+        return 0
+    if df.attrs.get("spill_dir"):
+        return int(sum(df[col].cat.categories.memory_usage(deep=True) for col in df.select_dtypes("category")))
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class DataFrameCache:
+    """Process-wide LRU cache of parsed dataframes keyed by dataset fingerprint
+
+    Entries are evicted least-recently-used first once the combined frame
+    size passes the byte budget. A frame larger than the whole budget is
+    still returned to the caller, it just isn't kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._frames = LRUCache(max_bytes=max_bytes)  # fingerprint -> df
+        self._lock = threading.Lock()
+        # One lock per fingerprint being parsed, so concurrent uploads of the
+        # same file parse it once
+        self._loading = {}
+
+    def get(self, fingerprint):
+        """Return the cached frame for a fingerprint, or None"""
+        return self._frames.get(fingerprint)
+
+    def put(self, fingerprint, df):
+        """Store a frame and evict older ones until the cache fits its budget"""
+        nbytes = frame_nbytes(df)
+        if nbytes > self.max_bytes:
+            self._frames.pop(fingerprint)
+            logger.info(f"Dataset {fingerprint} ({nbytes} bytes) exceeds cache budget, not cached")
+            return df
+        for evicted, evicted_bytes in self._frames.put(fingerprint, df, nbytes):
+            logger.info(f"Evicted dataset {evicted} ({evicted_bytes} bytes) from dataframe cache")
+        return df
+
+    def get_or_load(self, fingerprint, loader):
+        """Return the cached frame, calling loader() once to parse it on a miss"""
+        df = self.get(fingerprint)
+        if df is not None:
+            return df
+        with self._lock:
+            load_lock = self._loading.setdefault(fingerprint, threading.Lock())
+        with load_lock:
+            try:
+                df = self.get(fingerprint)
+                if df is None:
+                    df = self.put(fingerprint, loader())
+                return df
+            finally:
+                with self._lock:
+                    self._loading.pop(fingerprint, None)
+
+    def stats(self):
+        """Return entry count and memory use for display"""
+        return {"entries": len(self._frames), "bytes": self._frames.nbytes, "max_bytes": self.max_bytes}
+
+
+dataframe_cache = DataFrameCache(int(DATAFRAME_CACHE_MB * 1024 * 1024))
+
+
+def load_uploaded_dataframe(uploaded_file, fingerprint=None, progress=None):
+    """Load an upload through the shared cache and return (fingerprint, df)
+
+    CSV files are parsed into a DataFrame; Parquet and Arrow files are opened
+    as a memory-mapped ColumnarDataset. progress is passed to the chunked CSV
+    reader and only called on a cache miss.
+    """
+    if fingerprint is None:
+        with span("upload_fingerprint"):
+            fingerprint = fingerprint_upload(uploaded_file)
+
+    def loader():
+        with span("upload_parse"):
+            if is_columnar_upload(uploaded_file.name):
+                return open_columnar_upload(uploaded_file, fingerprint)
+            uploaded_file.seek(0)
+            return read_csv_optimized(uploaded_file, total_bytes=uploaded_file.size, progress=progress)
+
+    return fingerprint, dataframe_cache.get_or_load(fingerprint, loader)
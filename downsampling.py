@@ -0,0 +1,129 @@
+import pandas as pd
+import numpy as np
+import os
+
+# Most points a line or scatter chart sends to the browser
+CHART_POINT_BUDGET = int(os.getenv('CHART_POINT_BUDGET', '5000'))
+# "lttb" keeps the visual shape of a line, "minmax" keeps every local extreme
+LINE_DOWNSAMPLE_METHOD = os.getenv('LINE_DOWNSAMPLE_METHOD', 'lttb')
+# Scatter plots are thinned on a grid of this many cells per axis
+SCATTER_GRID_SIZE = 64
+
+
+def _positions(values):
+    """Numeric positions for a column: its values if numeric or dates, else the row order"""
+    if values.dtype.kind in "iuf":
+        return values.to_numpy(dtype=np.float64)
+    if values.dtype.kind == "M":
+        return values.to_numpy().astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return np.arange(len(values), dtype=np.float64)
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: pick n_out row positions that keep a line's shape"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    # Bucket edges over the interior points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs(
+            (x[previous] - avg_x) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Min/max bucketing: keep the lowest and highest point of every bucket, in row order"""
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    n_buckets = n_out // 2
+    bucket = (np.arange(n) * n_buckets) // n
+    order = np.lexsort((y, bucket))
+    # First and last of each bucket after sorting by (bucket, y) are its min and max
+    boundaries = np.flatnonzero(np.diff(bucket[order])) + 1
+    firsts = np.concatenate(([0], boundaries))
+    lasts = np.concatenate((boundaries - 1, [n - 1]))
+    return np.unique(np.concatenate((order[firsts], order[lasts])))
+
+
+def _line_indices(x, y, n_out):
+    y_values = y.to_numpy(dtype=np.float64, na_value=np.nan)
+    if np.isnan(y_values).any():
+        # Gaps can't be ranked, fall back to an even stride
+        return np.linspace(0, len(y) - 1, n_out).astype(np.int64)
+    if LINE_DOWNSAMPLE_METHOD == "minmax":
+        return minmax_indices(y_values, n_out)
+    x_values = _positions(x)
+    if not (np.diff(x_values) >= 0).all():
+        # Unsorted x is drawn in row order, so rank triangles by row position
+        x_values = np.arange(len(x), dtype=np.float64)
+    return lttb_indices(x_values, y_values, n_out)
+
+
+def downsample_line(df, x_column, y_column, budget=CHART_POINT_BUDGET, group_column=None):
+    """Reduce a line chart's rows to about budget points, shared between its traces"""
+    if len(df) <= budget or df[y_column].dtype.kind not in "iuf":
+        return df
+    if group_column is None:
+        return df.iloc[_line_indices(df[x_column], df[y_column], budget)]
+    groups = df.groupby(group_column, sort=False, observed=True).indices
+    per_trace = max(budget // max(len(groups), 1), 3)
+    keep = [
+        positions[_line_indices(df[x_column].iloc[positions], df[y_column].iloc[positions], per_trace)]
+        for positions in groups.values()
+    ]
+    return df.iloc[np.sort(np.concatenate(keep))] if keep else df
+
+
+def downsample_scatter(df, x_column, y_column, budget=CHART_POINT_BUDGET, seed=0):
+    """Thin a scatter plot to about budget points without losing sparse regions
+
+    Points are binned on a grid and every cell keeps at most the same number
+    of randomly chosen points, so dense clusters are thinned while isolated
+    points and outliers all survive.
+    """
+    n = len(df)
+    if n <= budget:
+        return df
+    cells = np.zeros(n, dtype=np.int64)
+    for column in (x_column, y_column):
+        positions = _positions(df[column]) if df[column].dtype.kind in "iufM" \
+            else pd.factorize(df[column])[0].astype(np.float64)
+        low, high = np.nanmin(positions), np.nanmax(positions)
+        scaled = (positions - low) / (high - low) if high > low else np.zeros(n)
+        binned = np.clip(np.nan_to_num(scaled * SCATTER_GRID_SIZE), 0, SCATTER_GRID_SIZE - 1).astype(np.int64)
+        cells = cells * SCATTER_GRID_SIZE + binned
+
+    # Largest per-cell cap c with sum(min(count, c)) within budget
+    counts = np.bincount(cells)
+    counts = np.sort(counts[counts > 0])
+    n_cells = len(counts)
+    below = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    totals = below + counts * (n_cells - np.arange(n_cells))
+    full = np.searchsorted(totals, budget, side="right")  # Cells kept whole
+    if full == 0:
+        cap = budget // n_cells
+    else:
+        cap = (budget - below[full]) // (n_cells - full)
+    cap = max(int(cap), 1)
+
+    shuffled = np.random.default_rng(seed).permutation(n)
+    rank_in_cell = pd.Series(cells[shuffled]).groupby(cells[shuffled]).cumcount().to_numpy()
+    keep = np.sort(shuffled[rank_in_cell < cap])
+    return df.iloc[keep]
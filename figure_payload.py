@@ -0,0 +1,89 @@
+import pandas as pd
+import numpy as np
+import os
+
+# Line and scatter charts with more points than this are drawn with WebGL traces
+WEBGL_POINT_THRESHOLD = int(os.getenv('WEBGL_POINT_THRESHOLD', '1000'))
+# Significant digits kept for float data sent to the browser
+FIGURE_SIGNIFICANT_DIGITS = int(os.getenv('FIGURE_SIGNIFICANT_DIGITS', '6'))
+# Categorical axes with more distinct labels than this are left as text
+MAX_ENCODED_CATEGORIES = 200
+
+_ENCODABLE_TRACES = {"scatter", "scattergl", "bar"}
+
+
+def render_mode(n_points):
+    """Plotly Express render mode for a line or scatter chart of n_points"""
+    return "webgl" if n_points > WEBGL_POINT_THRESHOLD else "svg"
+
+
+def round_significant(values, digits=FIGURE_SIGNIFICANT_DIGITS):
+    """Round each value of a float array to the given number of its own significant digits"""
+    values = np.asarray(values, dtype=np.float64)
+    nonzero = np.isfinite(values) & (values != 0)
+    if not nonzero.any():
+        return values
+    decimals = np.zeros(values.shape, dtype=np.int64)
+    decimals[nonzero] = digits - 1 - np.floor(np.log10(np.abs(values[nonzero]))).astype(np.int64)
+    rounded = values.copy()
+    # One np.round per order of magnitude, of which real data has few
+    for places in np.unique(decimals[nonzero]):
+        selected = nonzero & (decimals == places)
+        rounded[selected] = np.round(values[selected], places)
+    return rounded
+
+
+def _as_array(values):
+    return values if isinstance(values, np.ndarray) else np.asarray(values)
+
+
+def _encode_categorical_x(fig):
+    # Only traces on the main x axis with repeated text labels are worth encoding
+    traces = [
+        trace for trace in fig.data
+        if trace.type in _ENCODABLE_TRACES and trace.x is not None and trace.y is not None
+        and getattr(trace, "orientation", None) != "h" and (trace.xaxis or "x") == "x"
+        and _as_array(trace.x).dtype.kind in "OU"
+    ]
+    if not traces or len(traces) != sum(1 for trace in fig.data if trace.x is not None):
+        return
+    labels = [_as_array(trace.x) for trace in traces]
+    codes, categories = pd.factorize(np.concatenate(labels), sort=False)
+    if len(categories) > MAX_ENCODED_CATEGORIES or len(categories) * 2 > len(codes):
+        return
+
+    offset = 0
+    for trace, trace_labels in zip(traces, labels):
+        trace.x = codes[offset:offset + len(trace_labels)].astype(np.int32)
+        offset += len(trace_labels)
+    # Hover labels come from ticktext too, since every code sits exactly on a tick, so %{x} still shows the category
+    fig.update_xaxes(
+        type="linear",
+        tickmode="array",
+        tickvals=list(range(len(categories))),
+        ticktext=[str(category) for category in categories]
+    )
+
+
+def compact_figure(fig, digits=FIGURE_SIGNIFICANT_DIGITS):
+    """Shrink a figure's serialized size in place
+
+    Float arrays are rounded to a few significant digits so they print
+    short, and repeated text x values are sent once as tick labels with
+    integer codes per point.
+    """
+    for trace in fig.data:
+        for attribute in ("x", "y"):
+            values = getattr(trace, attribute, None)
+            if values is None:
+                continue
+            array = _as_array(values)
+            if array.dtype.kind == "f":
+                setattr(trace, attribute, round_significant(array, digits))
+    _encode_categorical_x(fig)
+    return fig
+
+
+def figure_payload_size(fig):
+    """Bytes of JSON sent to the browser for a figure"""
+    return len(fig.to_json().encode())
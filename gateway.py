@@ -0,0 +1,517 @@
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from gateway_scheduler import gateway_scheduler
+from latency import span
+import logging
+import threading
+import hashlib
+import random
+import copy
+import json
+import requests
+import time
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Refresh the token this many seconds before the gateway says it expires
+TOKEN_REFRESH_MARGIN = float(os.getenv('OAUTH_TOKEN_REFRESH_MARGIN', '60'))
+# Used when the token endpoint does not return expires_in
+DEFAULT_TOKEN_LIFETIME = float(os.getenv('OAUTH_DEFAULT_TOKEN_LIFETIME', '300'))
+
+CONNECT_TIMEOUT = float(os.getenv('GATEWAY_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('GATEWAY_READ_TIMEOUT', '120'))
+POOL_SIZE = int(os.getenv('GATEWAY_POOL_SIZE', '20'))
+
+# Retries after a connection error, 429 or 5xx, with jittered exponential backoff
+MAX_RETRIES = int(os.getenv('GATEWAY_MAX_RETRIES', '3'))
+# Time budget for one call including retries and backoff; no attempt's read timeout runs past it
+CALL_DEADLINE = float(os.getenv('GATEWAY_CALL_DEADLINE', '150'))
+BACKOFF_BASE = float(os.getenv('GATEWAY_BACKOFF_BASE', '0.5'))
+BACKOFF_MAX = float(os.getenv('GATEWAY_BACKOFF_MAX', '8'))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Consecutive failed calls that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('GATEWAY_CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('GATEWAY_CIRCUIT_RESET_SECONDS', '30'))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide pooled HTTP session for gateway traffic"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def get_timeout(deadline=None):
+    """Return the (connect, read) timeout tuple used for gateway calls, shortened to end by deadline"""
+    if deadline is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return (CONNECT_TIMEOUT, min(READ_TIMEOUT, max(deadline - time.monotonic(), 0.1)))
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the gateway while it is considered unhealthy"""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated gateway failures
+
+    After failure_threshold consecutive failed calls the circuit opens and
+    calls are rejected for reset_seconds. Then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half_open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go to the gateway now; return True for the trial call"""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._trial_running:
+                self._trial_running = True
+                return True
+        raise CircuitOpenError(
+            f"The gateway is unavailable after repeated failures, retry in {max(remaining, 1):.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    logger.warning(f"Opening gateway circuit after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def end_trial(self):
+        """Let another trial through when this one ended without an outcome, e.g. its script was stopped"""
+        with self._lock:
+            self._trial_running = False
+
+
+circuit_breaker = CircuitBreaker()
+
+
+def _backoff(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt: full jitter, or the server's Retry-After"""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date form, fall back to our own schedule
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _post_with_retries(url, idempotent=False, deadline_seconds=CALL_DEADLINE, **kwargs):
+    """POST with bounded retries on connection errors, 429 and 5xx, all within deadline_seconds
+
+    Read timeouts are only retried for idempotent requests: a chat request
+    that timed out may still be running upstream, and sending it again
+    would hold a gateway slot for another full read timeout. Returns the
+    last response, which may still carry a retryable status once the
+    retries or the deadline are used up.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    retryable = (requests.ConnectionError, requests.Timeout) if idempotent else requests.ConnectionError
+    attempt = 0
+    while True:
+        try:
+            response = get_session().post(url, timeout=get_timeout(deadline), **kwargs)
+        except retryable as e:
+            delay = _backoff(attempt)
+            if attempt >= MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+            logger.warning(f"Gateway request failed ({str(e)}), retrying in {delay:.1f}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                return response
+            delay = _backoff(attempt, response.headers.get('Retry-After'))
+            if time.monotonic() + delay >= deadline:
+                return response
+            logger.warning(f"Gateway returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+        attempt += 1
+        time.sleep(delay)
+
+
+class TokenManager:
+    """Caches the client-credentials OAuth token until shortly before it expires"""
+
+    def __init__(self, token_url=None, client_id=None, client_secret=None, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_valid(self):
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def get_token(self):
+        """Return a cached token, fetching a new one if it is missing or about to expire"""
+        if self._is_valid():
+            return self._token
+        with self._lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            if self._is_valid():
+                return self._token
+            self._fetch()
+            return self._token
+
+    def invalidate(self):
+        """Drop the cached token so the next call fetches a fresh one"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def _fetch(self):
+        with span("token_fetch"):
+            # Asking for a token again is harmless, so read timeouts are retried here
+            response = _post_with_retries(
+                self.token_url or os.getenv('OAUTH_TOKEN_URL'),
+                idempotent=True,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                data={
+                    'grant_type': 'client_credentials',
+                    'client_id': self.client_id or os.getenv('OAUTH_CLIENT_ID'),
+                    'client_secret': self.client_secret or os.getenv('OAUTH_CLIENT_SECRET')
+                }
+            )
+            response.raise_for_status()
+            payload = response.json()
+        lifetime = float(payload.get('expires_in') or DEFAULT_TOKEN_LIFETIME)
+        self._token = payload['access_token']
+        self._expires_at = time.monotonic() + lifetime
+        logger.info(f"Fetched new OAuth token (expires in {lifetime:.0f}s)")
+
+
+token_manager = TokenManager()
+
+
+def _send(payload, stream=False):
+    trial = circuit_breaker.before_call()
+    try:
+        try:
+            for attempt in range(2):
+                response = _post_with_retries(
+                    os.getenv('MULESOFT_API_URL'),
+                    headers={
+                        'Content-Type': 'application/json',
+                        'Authorization': f'Bearer {token_manager.get_token()}',
+                        'Accept': 'text/event-stream, */*' if stream else '*/*'
+                    },
+                    json=payload,
+                    stream=stream
+                )
+                # A revoked or early-expired token gets one fresh retry
+                if response.status_code == 401 and attempt == 0:
+                    response.close()
+                    token_manager.invalidate()
+                    continue
+                break
+        except Exception:
+            # Connection errors and timeouts after retries, or no token to send with
+            circuit_breaker.record_failure()
+            raise
+        if response.status_code in RETRY_STATUSES:
+            circuit_breaker.record_failure()
+        else:
+            # The gateway answered, even if it rejected this request
+            circuit_breaker.record_success()
+    finally:
+        if trial:
+            # Streamlit's StopException and RerunException are BaseExceptions and skip the handlers above
+            circuit_breaker.end_trial()
+    response.raise_for_status()
+    return response
+
+
+class FlightCancelledError(RuntimeError):
+    """The caller making a shared upstream call went away before it finished"""
+
+
+class _Flight:
+    """One upstream call whose output is shared with identical requests made while it runs"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._orphan = None  # Upstream chunk iterator left behind by a cancelled leader
+        self._cond = threading.Condition()
+
+    def add(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def join(self):
+        with self._cond:
+            self.followers += 1
+
+    def hand_over(self, chunks):
+        """Leave the rest of the upstream call to a follower; False if there is none"""
+        with self._cond:
+            if not self.followers:
+                return False
+            self._orphan = chunks
+            self._cond.notify_all()
+            return True
+
+    def leave(self):
+        """Drop a follower; return the upstream call it would have inherited if it was the last one"""
+        with self._cond:
+            self.followers -= 1
+            if self.followers or self._orphan is None:
+                return None
+            chunks, self._orphan = self._orphan, None
+            return chunks
+
+    def replay(self):
+        """Yield the chunks so far and as they arrive
+
+        Returns the upstream chunk iterator if the leader went away mid-call
+        and this follower is to carry it on, otherwise None.
+        """
+        position = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: position < len(self.chunks) or self.done or self._orphan is not None)
+                pending = self.chunks[position:]
+                finished = self.done
+                inherited = None
+                if not pending and not finished and self._orphan is not None:
+                    inherited, self._orphan = self._orphan, None
+            position += len(pending)
+            yield from pending
+            if inherited is not None:
+                return inherited
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _flight_key(payload):
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+def _land(key, flight, error=None):
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+    flight.finish(error)
+
+
+def _single_flight(payload, produce, session_id=None, on_wait=None):
+    """Yield the chunks of produce(), running it once for concurrent identical payloads
+
+    The first caller takes a scheduler slot and makes the upstream call;
+    callers with the same payload that arrive before it finishes replay its
+    output instead of sending the request again. If the first caller goes
+    away while queued, the others make the call themselves; if it goes away
+    mid-response, one of them carries on reading the same upstream response.
+    """
+    key = _flight_key(payload)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        if not leader:
+            flight.join()
+    if not leader:
+        gateway_scheduler.record_coalesced()
+        yield from _follow(key, flight, payload, produce, session_id, on_wait)
+        return
+
+    acquired = False
+    try:
+        with span("gateway_queue"):
+            gateway_scheduler.acquire(session_id, on_wait)
+        acquired = True
+        chunks = produce()
+    except BaseException as e:
+        if acquired:
+            gateway_scheduler.release()
+        # A Streamlit stop or rerun belongs to this caller's script, not to the followers
+        _land(key, flight, e if isinstance(e, Exception) else FlightCancelledError(
+            "The request was cancelled before it reached the gateway"))
+        raise
+    yield from _drive(key, flight, chunks)
+
+
+def _drive(key, flight, chunks):
+    """Yield the upstream chunks, sharing each with the flight, then release the slot"""
+    error = None
+    handed_over = False
+    try:
+        for chunk in chunks:
+            flight.add(chunk)
+            yield chunk
+    except GeneratorExit:
+        handed_over = flight.hand_over(chunks)
+        if not handed_over:
+            error = FlightCancelledError("The request was cancelled before the gateway finished responding")
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        if not handed_over:
+            chunks.close()
+            gateway_scheduler.release()
+            _land(key, flight, error)
+
+
+def _follow(key, flight, payload, produce, session_id, on_wait):
+    """Replay a flight's output, making the call or carrying it on if its leader goes away"""
+    replay = flight.replay()
+    replayed = False
+    try:
+        while True:
+            try:
+                chunk = next(replay)
+            except StopIteration as stop:
+                inherited = stop.value
+                break
+            replayed = True
+            yield chunk
+    except FlightCancelledError:
+        flight.leave()
+        if replayed:
+            raise
+        logger.info("Coalesced gateway request lost its leader before the call, calling the gateway itself")
+        yield from _single_flight(payload, produce, session_id, on_wait)
+        return
+    except BaseException:
+        orphan = flight.leave()
+        if orphan is not None:
+            # This was the last caller waiting for the rest of the response
+            orphan.close()
+            gateway_scheduler.release()
+            _land(key, flight, FlightCancelledError("Every caller left before the gateway finished responding"))
+        raise
+    flight.leave()
+    if inherited is not None:
+        logger.info("Carrying on a coalesced gateway response after its leader was cancelled")
+        yield from _drive(key, flight, inherited)
+
+
+def _json_body(payload):
+    yield _send(payload).json()
+
+
+def post_to_gateway(payload, session_id=None, on_wait=None):
+    """POST a chat payload to the Mulesoft API and return the parsed JSON body
+
+    Calls are admitted through the process-wide scheduler (queued fairly per
+    session_id, with on_wait(position) called while waiting) and identical
+    concurrent payloads share one upstream request.
+    """
+    result, = list(_single_flight(payload, lambda: _json_body(payload), session_id, on_wait))
+    # Coalesced callers each get their own copy to mutate
+    return copy.deepcopy(result)
+
+
+def _extract_delta(event):
+    """Pull the text out of one streamed event, whatever shape the gateway used"""
+    if isinstance(event, str):
+        return event
+    if not isinstance(event, dict):
+        return ''
+    if isinstance(event.get('delta'), dict):
+        return event['delta'].get('text', '') or ''
+    for key in ('result', 'completion', 'text'):
+        if isinstance(event.get(key), str):
+            return event[key]
+    return ''
+
+
+def stream_from_gateway(payload, session_id=None, on_wait=None):
+    """POST a chat payload with streaming enabled and yield text chunks as they arrive
+
+    Handles server-sent events, plain chunked text, and gateways that ignore
+    the stream flag and answer with a single JSON body. Scheduling and
+    coalescing work as in post_to_gateway; the slot is held until the stream ends.
+    """
+    payload = {**payload, "stream": True}
+    yield from _single_flight(payload, lambda: _stream_chunks(payload), session_id, on_wait)
+
+
+def _stream_chunks(payload):
+    response = _send(payload, stream=True)
+    try:
+        content_type = response.headers.get('Content-Type', '')
+        if 'text/event-stream' in content_type:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    delta = _extract_delta(json.loads(data))
+                except json.JSONDecodeError:
+                    delta = data
+                if delta:
+                    yield delta
+        elif 'application/json' in content_type:
+            yield _extract_delta(response.json())
+        else:
+            response.encoding = response.encoding or 'utf-8'
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    yield chunk
+    finally:
+        response.close()
@@ -0,0 +1,152 @@
+from collections import OrderedDict, deque
+import threading
+import logging
+import time
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Upstream gateway calls allowed at once across all sessions
+GATEWAY_MAX_CONCURRENT = int(os.getenv('GATEWAY_MAX_CONCURRENT', '4'))
+# Calls allowed to wait for a slot before new ones are turned away
+GATEWAY_MAX_QUEUE = int(os.getenv('GATEWAY_MAX_QUEUE', '100'))
+# How often a waiting caller is told its queue position
+QUEUE_POLL_SECONDS = 0.25
+# Recent queue waits kept for the wait-time percentiles
+WAIT_SAMPLES = 1000
+
+
+class GatewayBusyError(Exception):
+    """Raised when the gateway queue is full"""
+
+
+class _Ticket:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.granted = threading.Event()
+
+
+class GatewayScheduler:
+    """Bounded, per-session fair admission for gateway calls
+
+    At most max_concurrent calls run at once. Waiting calls are queued per
+    session and slots are handed out round-robin between sessions, so one
+    session sending many requests can't starve the others.
+    """
+
+    def __init__(self, max_concurrent=GATEWAY_MAX_CONCURRENT, max_queue=GATEWAY_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._queues = OrderedDict()  # session_id -> deque of tickets, in round-robin order
+        self._queued = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counts = {"served": 0, "rejected": 0, "coalesced": 0}
+
+    def _dispatch(self):
+        # Called with the lock held
+        while self._in_flight < self.max_concurrent and self._queues:
+            session_id, tickets = next(iter(self._queues.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                # The session goes to the back of the line for its next call
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            self._queued -= 1
+            self._in_flight += 1
+            ticket.granted.set()
+
+    def _position(self, ticket):
+        # 1-based position under round-robin: every session gets one turn per round, in ring order
+        tickets = self._queues.get(ticket.session_id)
+        if tickets is None or ticket not in tickets:
+            return 0
+        depth = tickets.index(ticket)
+        ahead = 0
+        before = True
+        for session_id, queue in self._queues.items():
+            if session_id == ticket.session_id:
+                before = False
+                ahead += depth
+            else:
+                ahead += min(len(queue), depth + 1 if before else depth)
+        return ahead + 1
+
+    def acquire(self, session_id=None, on_wait=None):
+        """Block until a slot is free for this session, calling on_wait(position) while queued"""
+        ticket = _Ticket(session_id)
+        start = time.monotonic()
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._counts["rejected"] += 1
+                raise GatewayBusyError("The assistant is busy, please try again in a moment")
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+
+        last_position = None
+        try:
+            while not ticket.granted.wait(QUEUE_POLL_SECONDS):
+                if on_wait is None:
+                    continue
+                with self._lock:
+                    position = self._position(ticket)
+                if position and position != last_position:
+                    last_position = position
+                    on_wait(position)
+        except BaseException:
+            # The caller went away (e.g. a Streamlit rerun stopped the script) while queued
+            self._abandon(ticket)
+            raise
+
+        wait = time.monotonic() - start
+        with self._lock:
+            self._waits.append(wait)
+        if wait >= 1:
+            logger.info(f"Gateway call waited {wait:.1f}s for a slot")
+
+    def _abandon(self, ticket):
+        with self._lock:
+            tickets = self._queues.get(ticket.session_id)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._queues[ticket.session_id]
+                self._queued -= 1
+                return
+            # Granted just before the caller left, so hand the slot straight on without counting it as served
+            self._in_flight -= 1
+            self._dispatch()
+
+    def release(self):
+        """Free a slot taken by acquire and admit the next waiting call"""
+        with self._lock:
+            self._in_flight -= 1
+            self._counts["served"] += 1
+            self._dispatch()
+
+    def record_coalesced(self):
+        with self._lock:
+            self._counts["coalesced"] += 1
+
+    def stats(self):
+        """Queue depth, in-flight calls, counters and recent wait-time percentiles in seconds"""
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = dict(
+                self._counts,
+                in_flight=self._in_flight,
+                queued=self._queued,
+                sessions_waiting=len(self._queues),
+                max_concurrent=self.max_concurrent
+            )
+        for name, fraction in (("wait_p50", 0.5), ("wait_p95", 0.95)):
+            stats[name] = waits[min(int(fraction * len(waits)), len(waits) - 1)] if waits else 0.0
+        stats["wait_max"] = waits[-1] if waits else 0.0
+        return stats
+
+
+gateway_scheduler = GatewayScheduler()
@@ -0,0 +1,109 @@
+from lru import LRUCache
+import threading
+import logging
+import hashlib
+import json
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_MB = float(os.getenv('IMAGE_CACHE_MB', '128'))
+# Rendered images are also kept on disk here when set
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '')
+IMAGE_CACHE_DISK_MB = float(os.getenv('IMAGE_CACHE_DISK_MB', '1024'))
+
+
+def image_key(figure, **settings):
+    """Content hash of a figure's data and layout plus the render settings"""
+    spec = figure.to_json() if hasattr(figure, "to_json") else json.dumps(figure, sort_keys=True, default=str)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(spec.encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """Rendered chart images by content hash: a byte-budget LRU in memory and an optional directory
+
+    The disk tier keeps one file per image and drops the least recently
+    used files once it holds more than disk_bytes.
+    """
+
+    def __init__(self, max_bytes=int(IMAGE_CACHE_MB * 1024 * 1024), directory=IMAGE_CACHE_DIR,
+                 disk_bytes=int(IMAGE_CACHE_DISK_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.disk_bytes = disk_bytes
+        self._images = LRUCache(max_bytes=max_bytes)
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.img")
+
+    def get(self, key):
+        """Return the cached image bytes, or None"""
+        image = self._images.get(key)
+        if image is None:
+            image = self._read_disk(key)
+            if image is not None:
+                self._images.put(key, image, len(image))
+        with self._lock:
+            self._counts["hits" if image is not None else "misses"] += 1
+        return image
+
+    def put(self, key, image):
+        self._images.put(key, image, len(image))
+        self._write_disk(key, image)
+
+    def _read_disk(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                image = f.read()
+            # Bump the modification time so eviction sees it as recently used
+            os.utime(self._path(key))
+            return image
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Error reading cached image: {str(e)}")
+            return None
+
+    def _write_disk(self, key, image):
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(image)
+            os.replace(temp_path, self._path(key))
+            self._evict_disk()
+        except OSError as e:
+            logger.error(f"Error writing cached image: {str(e)}")
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".img"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._images), bytes=self._images.nbytes)
+
+
+image_cache = ImageCache()
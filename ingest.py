@@ -0,0 +1,480 @@
+from pandas.api.types import union_categoricals
+from pandas.tseries.api import guess_datetime_format
+import pandas as pd
+import numpy as np
+import tempfile
+import warnings
+import weakref
+import logging
+import shutil
+import time
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '200000'))
+# Past this many bytes of parsed data, the upload is spilled to disk instead
+INGEST_MEMORY_LIMIT_MB = float(os.getenv('INGEST_MEMORY_LIMIT_MB', '1024'))
+SPILL_DIR = os.getenv('SPILL_DIR', os.path.join(tempfile.gettempdir(), 'datacharts_spill'))
+# Distinct values a spilled text column keeps in memory as category labels; past this it is stored on disk
+SPILL_MAX_LABELS = int(os.getenv('SPILL_MAX_LABELS', '100000'))
+
+# A text column becomes a category when at most this share of its values are distinct
+CATEGORY_MAX_RATIO = 0.5
+# Share of sampled values that must parse with one format for a column to be treated as dates
+DATE_MIN_PARSED_RATIO = 0.9
+DATE_SAMPLE_ROWS = 200
+
+
+def plan_dtypes(sample):
+    """Decide from the first chunk which text columns become dates and which become categories"""
+    plan = {}
+    for col in sample.columns:
+        if sample[col].dtype != object:
+            continue
+        values = sample[col].dropna()
+        if values.empty:
+            continue
+        date_format = _date_format(values.head(DATE_SAMPLE_ROWS))
+        if date_format:
+            plan[col] = ("datetime", date_format)
+        elif values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            plan[col] = ("category", None)
+    return plan
+
+
+def _date_format(values):
+    first = values.iloc[0]
+    if not isinstance(first, str) or not any(ch.isdigit() for ch in first):
+        return None
+    date_format = guess_datetime_format(first)
+    if date_format is None:
+        return None
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+    if parsed.notna().mean() < DATE_MIN_PARSED_RATIO:
+        return None
+    return date_format
+
+
+def optimize_chunk(chunk, plan):
+    """Apply the dtype plan to one chunk and downcast its numeric columns"""
+    for col in chunk.columns:
+        kind, date_format = plan.get(col, (None, None))
+        series = chunk[col]
+        if kind == "datetime":
+            chunk[col] = pd.to_datetime(series, format=date_format, errors='coerce')
+        elif kind == "category":
+            chunk[col] = series.astype("category")
+        elif series.dtype.kind in "iu":
+            chunk[col] = pd.to_numeric(series, downcast="integer" if series.dtype.kind == "i" else "unsigned")
+        elif series.dtype.kind == "f":
+            downcast = series.astype(np.float32)
+            # Only keep float32 when no value changes
+            if ((downcast == series) | series.isna()).all():
+                chunk[col] = downcast
+    return chunk
+
+
+def _combine(chunks, plan):
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if plan.get(col, (None,))[0] == "category":
+            # Chunks saw different category sets, merge them without going through object
+            columns[col] = pd.Series(union_categoricals(parts), name=col)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+class ColumnarSpill:
+    """Appends chunks to one raw binary file per column and reopens them memory-mapped
+
+    Numeric columns are stored as int64/float64, dates as int64 nanoseconds,
+    and everything else as int32 dictionary codes whose labels stay in memory.
+    A numeric column that meets text in a later chunk is widened to codes,
+    and a codes column with more than max_labels distinct values moves to
+    an Arrow file of strings, so its labels don't have to fit in memory.
+    """
+
+    def __init__(self, directory, max_labels=SPILL_MAX_LABELS):
+        self.directory = directory
+        self.max_labels = max_labels
+        self.rows = 0
+        self._columns = {}  # column -> {"kind", "dtype", "path", "labels", "lookup"} or Arrow writer for "text"
+
+    def append(self, chunk):
+        for position, col in enumerate(chunk.columns):
+            series = chunk[col]
+            meta = self._columns.get(col)
+            if meta is None:
+                meta = self._columns[col] = self._new_column(position, series)
+            if meta["kind"] == "numeric" and series.dtype.kind not in "iufb":
+                self._widen_to_codes(meta)
+            if meta["kind"] == "text":
+                self._write_text(meta, series)
+                continue
+            if meta["kind"] == "numeric":
+                if series.dtype.kind == "f" and meta["dtype"] == np.int64:
+                    self._widen_to_float(meta)
+                if meta["dtype"] == np.float64:
+                    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+                else:
+                    values = series.to_numpy(dtype=np.int64)
+            elif meta["kind"] == "datetime":
+                values = pd.to_datetime(series, errors='coerce').to_numpy(dtype="datetime64[ns]").view(np.int64)
+            else:
+                values = self._encode(meta, series)
+            with open(meta["path"], "ab") as f:
+                f.write(np.ascontiguousarray(values).tobytes())
+            if meta["kind"] == "codes" and len(meta["labels"]) > self.max_labels:
+                self._codes_to_text(meta)
+        self.rows += len(chunk)
+
+    def _new_column(self, position, series):
+        path = os.path.join(self.directory, f"col_{position}.bin")
+        kind = series.dtype.kind
+        if kind in "iu":
+            return {"kind": "numeric", "dtype": np.int64, "path": path}
+        if kind == "f":
+            return {"kind": "numeric", "dtype": np.float64, "path": path}
+        if kind == "M":
+            return {"kind": "datetime", "dtype": np.int64, "path": path}
+        return {"kind": "codes", "dtype": np.int32, "path": path, "labels": [], "lookup": {}}
+
+    def _widen_to_float(self, meta):
+        # A later chunk brought missing values into an integer column
+        existing = np.fromfile(meta["path"], dtype=np.int64) if os.path.exists(meta["path"]) else np.empty(0)
+        existing.astype(np.float64).tofile(meta["path"])
+        meta["dtype"] = np.float64
+
+    def _widen_to_codes(self, meta):
+        # A later chunk brought text into a numeric column, so the values so far become labels
+        existing = (np.fromfile(meta["path"], dtype=meta["dtype"]) if os.path.exists(meta["path"])
+                    else np.empty(0, dtype=meta["dtype"]))
+        meta.update(kind="codes", dtype=np.int32, labels=[], lookup={})
+        self._encode(meta, pd.Series(existing)).tofile(meta["path"])
+
+    def _encode(self, meta, series):
+        # Only the chunk's distinct values go through the label lookup, the rows are mapped with numpy
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            chunk_codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            chunk_codes, uniques = pd.factorize(series.astype(object) if series.dtype.kind != "O" else series)
+        lookup, labels = meta["lookup"], meta["labels"]
+        # The extra last slot maps missing values (code -1) to -1
+        mapping = np.full(len(uniques) + 1, -1, dtype=np.int32)
+        for i, value in enumerate(uniques):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(labels)
+                labels.append(value)
+            mapping[i] = code
+        return mapping[chunk_codes]
+
+    def _codes_to_text(self, meta):
+        # Rewrite the codes written so far as strings, then drop the labels
+        import pyarrow as pa
+
+        codes = np.fromfile(meta["path"], dtype=np.int32)
+        labels = np.array([str(label) for label in meta["labels"]] + [None], dtype=object)
+        os.remove(meta["path"])
+        path = f"{os.path.splitext(meta['path'])[0]}.arrow"
+        sink = pa.OSFile(path, "wb")
+        meta.clear()
+        meta.update(kind="text", path=path, sink=sink,
+                    writer=pa.ipc.new_file(sink, pa.schema([("value", pa.large_string())])))
+        batch_rows = CSV_CHUNK_ROWS
+        for start in range(0, len(codes), batch_rows):
+            # Missing values (code -1) pick the trailing None
+            self._write_strings(meta, labels[codes[start:start + batch_rows]])
+        logger.info(f"Spilled column at {path} has too many distinct values for categories, storing it as text")
+
+    def _write_text(self, meta, series):
+        values = series.astype(object)
+        missing = values.isna().to_numpy()
+        strings = values.astype(str).to_numpy(dtype=object)
+        strings[missing] = None
+        self._write_strings(meta, strings)
+
+    def _write_strings(self, meta, strings):
+        import pyarrow as pa
+
+        meta["writer"].write_batch(pa.record_batch([pa.array(strings, type=pa.large_string())], names=["value"]))
+
+    def _read_text(self, meta, col):
+        import pyarrow as pa
+
+        if "writer" in meta:
+            meta.pop("writer").close()
+            meta.pop("sink").close()
+        # Memory-mapped, so the strings stay on disk until they are read
+        table = pa.ipc.open_file(pa.memory_map(meta["path"], "r")).read_all()
+        return pd.Series(pd.arrays.ArrowExtensionArray(table.column(0)), name=col, copy=False)
+
+    def to_frame(self):
+        """Build a dataframe whose columns are backed by the memory-mapped files"""
+        columns = {}
+        for col, meta in self._columns.items():
+            if meta["kind"] == "text":
+                columns[col] = self._read_text(meta, col)
+                continue
+            if self.rows and os.path.exists(meta["path"]):
+                raw = np.memmap(meta["path"], dtype=meta["dtype"], mode="r", shape=(self.rows,))
+            else:
+                raw = np.empty(0, dtype=meta["dtype"])
+            if meta["kind"] == "numeric":
+                columns[col] = pd.Series(raw, name=col, copy=False)
+            elif meta["kind"] == "datetime":
+                columns[col] = pd.Series(pd.array(raw.view("datetime64[ns]"), copy=False), name=col, copy=False)
+            else:
+                categorical = pd.Categorical.from_codes(raw, categories=pd.Index(meta["labels"], dtype=object))
+                columns[col] = pd.Series(categorical, name=col, copy=False)
+        df = pd.DataFrame(columns, copy=False)
+        df.attrs["spill_dir"] = self.directory
+        # Remove the files once nothing references the frame any more
+        weakref.finalize(df, shutil.rmtree, self.directory, True)
+        return df
+
+
+def read_csv_optimized(source, total_bytes=None, progress=None,
+                       memory_limit=int(INGEST_MEMORY_LIMIT_MB * 1024 * 1024),
+                       chunk_rows=CSV_CHUNK_ROWS, spill_dir=SPILL_DIR):
+    """Read a CSV in chunks with compact dtypes, spilling to disk past memory_limit
+
+    progress, if given, is called as progress(fraction, message) after each chunk.
+    """
+    chunks = []
+    plan = None
+    spill = None
+    resident = 0
+    rows = 0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=pd.errors.DtypeWarning)
+        reader = pd.read_csv(source, chunksize=chunk_rows)
+        for chunk in reader:
+            if plan is None:
+                plan = plan_dtypes(chunk)
+            chunk = optimize_chunk(chunk, plan)
+            rows += len(chunk)
+
+            if spill is None:
+                chunks.append(chunk)
+                resident += int(chunk.memory_usage(index=True, deep=True).sum())
+                if resident > memory_limit:
+                    os.makedirs(spill_dir, exist_ok=True)
+                    spill = ColumnarSpill(tempfile.mkdtemp(dir=spill_dir))
+                    logger.info(f"CSV passed {memory_limit} bytes after {rows} rows, spilling to {spill.directory}")
+                    for pending in chunks:
+                        spill.append(pending)
+                    chunks = []
+            else:
+                spill.append(chunk)
+
+            if progress is not None:
+                fraction = min(source.tell() / total_bytes, 1.0) if total_bytes and hasattr(source, "tell") else 0.0
+                progress(fraction, f"Read {rows:,} rows" + (" (spilled to disk)" if spill else ""))
+
+    if spill is not None:
+        return spill.to_frame()
+    return _combine(chunks, plan)
+
+
+# Columnar formats are copied to local disk once and read memory-mapped from there
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'datacharts_uploads'))
+# Least recently opened copies are deleted once the directory holds more than this, or when unused this long
+UPLOAD_DIR_MB = float(os.getenv('UPLOAD_DIR_MB', '4096'))
+UPLOAD_MAX_AGE_HOURS = float(os.getenv('UPLOAD_MAX_AGE_HOURS', '24'))
+PARQUET_EXTENSIONS = {".parquet", ".pq"}
+ARROW_EXTENSIONS = {".arrow", ".feather", ".ipc"}
+COLUMNAR_EXTENSIONS = PARQUET_EXTENSIONS | ARROW_EXTENSIONS
+# Datasets still open in this process; pruning leaves their copies alone
+_open_datasets = weakref.WeakSet()
+
+
+class ColumnarDataset:
+    """A memory-mapped Parquet or Arrow IPC file that loads columns on demand
+
+    Supports the parts of the DataFrame API the app relies on (columns,
+    shape, dtypes, head, len and column indexing), so charts only pull the
+    columns they reference instead of the whole table.
+    """
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.format = "parquet" if os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS else "arrow"
+        if self.format == "parquet":
+            self._source = pa.memory_map(path, "r")
+            self._parquet = pq.ParquetFile(self._source)
+            self.schema = self._parquet.schema_arrow
+            self._num_rows = self._parquet.metadata.num_rows
+        else:
+            source = pa.memory_map(path, "r")
+            try:
+                self._table = pa.ipc.open_file(source).read_all()
+            except pa.ArrowInvalid:
+                source.seek(0)
+                self._table = pa.ipc.open_stream(source).read_all()
+            self.schema = self._table.schema
+            self._num_rows = self._table.num_rows
+        self.columns = pd.Index(self.schema.names)
+        self.dtypes = self.schema.empty_table().to_pandas().dtypes
+        _open_datasets.add(self)
+
+    @property
+    def shape(self):
+        return (self._num_rows, len(self.columns))
+
+    def __len__(self):
+        return self._num_rows
+
+    def to_arrow(self, columns=None):
+        """Return the requested columns as an Arrow table without converting to pandas"""
+        if self.format == "parquet":
+            return self._parquet.read(columns=columns)
+        return self._table.select(columns) if columns is not None else self._table
+
+    def arrow_dataset(self):
+        """Return a lazily scanned pyarrow dataset over the open file
+
+        Parquet reads only the queried columns and row groups from the
+        memory map already held, so the copy on disk is not reopened.
+        """
+        import pyarrow.dataset as pa_dataset
+
+        if self.format == "parquet":
+            file_format = pa_dataset.ParquetFileFormat()
+            return pa_dataset.FileSystemDataset([file_format.make_fragment(self._source)], self.schema, file_format)
+        return pa_dataset.dataset(self._table)
+
+    def load(self, columns=None):
+        """Materialize the requested columns (all of them if None) as a DataFrame"""
+        return self.to_arrow(columns).to_pandas()
+
+    def head(self, n=5):
+        if self.format == "parquet":
+            batch = next(self._parquet.iter_batches(batch_size=n), None)
+            if batch is None:
+                return self.schema.empty_table().to_pandas()
+            return batch.to_pandas().head(n)
+        return self._table.slice(0, n).to_pandas()
+
+    def column_statistics(self):
+        """{column: (nulls, min, max)} without converting the data to pandas
+
+        Parquet files answer from their row-group statistics, with None for
+        whatever the writer didn't record. Min and max are only given for
+        numeric and datetime columns, as in the full profile.
+        """
+        import pyarrow.compute as pc
+
+        ranged = {name for name, dtype in self.dtypes.items() if dtype.kind in "iufmM"}
+        if self.format == "arrow":
+            stats = {}
+            for name in self.columns:
+                column = self._table.column(name)
+                low = high = None
+                if name in ranged and column.null_count < len(column):
+                    result = pc.min_max(column)
+                    low, high = result["min"].as_py(), result["max"].as_py()
+                stats[name] = (column.null_count, low, high)
+            return stats
+
+        nulls = dict.fromkeys(self.columns, 0)
+        ranges = dict.fromkeys(ranged)
+        metadata = self._parquet.metadata
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                name = chunk.path_in_schema
+                statistics = chunk.statistics
+                if name not in nulls:
+                    continue  # Leaf of a nested column
+                if nulls[name] is not None:
+                    has_nulls = statistics is not None and statistics.has_null_count
+                    nulls[name] = nulls[name] + statistics.null_count if has_nulls else None
+                if name not in ranges or ranges[name] == (None, None):
+                    continue
+                if statistics is None or not statistics.has_min_max:
+                    if not (statistics is not None and statistics.has_null_count
+                            and statistics.null_count == row_group.num_rows):
+                        ranges[name] = (None, None)
+                    continue
+                low, high = ranges[name] or (statistics.min, statistics.max)
+                ranges[name] = (min(low, statistics.min), max(high, statistics.max))
+        return {name: (nulls[name], *(ranges.get(name) or (None, None))) for name in self.columns}
+
+    def duplicate_count(self):
+        """Number of rows that repeat an earlier row"""
+        table = self.to_arrow()
+        return table.num_rows - table.group_by(table.column_names).aggregate([]).num_rows
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.load([key])[key]
+        return self.load(list(key))
+
+    def __repr__(self):
+        return f"ColumnarDataset({self.path!r}, rows={self._num_rows}, columns={len(self.columns)})"
+
+
+def is_columnar_upload(filename):
+    """Check whether an uploaded file name has a Parquet or Arrow extension"""
+    return os.path.splitext(filename)[1].lower() in COLUMNAR_EXTENSIONS
+
+
+def open_columnar_upload(uploaded_file, fingerprint, upload_dir=UPLOAD_DIR,
+                         max_bytes=int(UPLOAD_DIR_MB * 1024 * 1024), max_age=UPLOAD_MAX_AGE_HOURS * 3600):
+    """Copy a Parquet/Arrow upload to local disk (once per fingerprint) and open it memory-mapped
+
+    Other copies are pruned to max_bytes and max_age seconds, least recently opened first.
+    """
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = os.path.join(upload_dir, f"{fingerprint}{extension}")
+    if os.path.exists(path):
+        # Bump the modification time so pruning sees it as recently used
+        os.utime(path)
+    else:
+        os.makedirs(upload_dir, exist_ok=True)
+        # Write under a temporary name so a concurrent reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=extension)
+        with os.fdopen(fd, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        os.replace(tmp_path, path)
+    dataset = ColumnarDataset(path)
+    _prune_uploads(upload_dir, path, max_bytes, max_age)
+    return dataset
+
+
+def _prune_uploads(upload_dir, keep, max_bytes, max_age):
+    # Copies behind a dataset that is still open (cached or in a session) are never deleted
+    in_use = {dataset.path for dataset in list(_open_datasets)}
+    cutoff = time.time() - max_age
+    entries = []
+    total = os.path.getsize(keep)
+    for entry in os.scandir(upload_dir):
+        if not entry.is_file() or entry.path == keep:
+            continue
+        stat = entry.stat()
+        total += stat.st_size
+        if entry.path in in_use:
+            continue
+        if entry.name.startswith(tempfile.gettempprefix()) and stat.st_mtime >= cutoff:
+            continue  # Another session's copy still being written
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes and mtime >= cutoff:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError as e:
+            logger.warning(f"Could not remove old upload {path}: {str(e)}")
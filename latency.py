@@ -0,0 +1,141 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import logging
+import time
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Recent durations kept per stage for the p50/p95/p99 figures
+LATENCY_SAMPLES = int(os.getenv('LATENCY_SAMPLES', '1000'))
+# Upper bounds in seconds of the Prometheus histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# When set, the Prometheus text is rewritten here after every chat turn (e.g. for node_exporter)
+LATENCY_METRICS_FILE = os.getenv('LATENCY_METRICS_FILE', '')
+METRIC_NAME = "datacharts_stage_seconds"
+QUANTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+class Trace:
+    """Stage durations of one chat turn, summed per stage, and the log entry they belong to"""
+
+    def __init__(self):
+        self.spans = {}
+        self.log_id = None
+
+    def add(self, stage, seconds):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+
+_current_trace = ContextVar("latency_trace", default=None)
+
+
+class LatencyStats:
+    """Per-process stage latencies: a cumulative histogram per stage plus recent samples for percentiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, samples=LATENCY_SAMPLES):
+        self.buckets = tuple(buckets)
+        self.samples = samples
+        self._stages = {}  # stage -> {"buckets": [...], "sum": float, "count": int, "recent": deque}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """Add one duration to the stage's histogram and to the current turn's trace, if any"""
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {
+                    "buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                    "recent": deque(maxlen=self.samples)
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += seconds
+            entry["count"] += 1
+            entry["recent"].append(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    def stats(self):
+        """{stage: {"count", "mean", "p50", "p95", "p99", "max"}} in seconds, percentiles over recent samples"""
+        with self._lock:
+            snapshot = {stage: (entry["count"], entry["sum"], sorted(entry["recent"]))
+                        for stage, entry in self._stages.items()}
+        stats = {}
+        for stage, (count, total, recent) in snapshot.items():
+            stage_stats = {"count": count, "mean": total / count if count else 0.0,
+                           "max": recent[-1] if recent else 0.0}
+            for name, fraction in QUANTILES:
+                stage_stats[name] = recent[min(int(fraction * len(recent)), len(recent) - 1)] if recent else 0.0
+            stats[stage] = stage_stats
+        return stats
+
+    def prometheus_text(self):
+        """Prometheus text exposition: a histogram per stage and gauges for the recent percentiles"""
+        with self._lock:
+            snapshot = {stage: (list(entry["buckets"]), entry["sum"], entry["count"])
+                        for stage, entry in sorted(self._stages.items())}
+        lines = [
+            f"# HELP {METRIC_NAME} Time spent in each stage of chat turns, exports and uploads",
+            f"# TYPE {METRIC_NAME} histogram"
+        ]
+        for stage, (buckets, total, count) in snapshot.items():
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {count}')
+        lines += [
+            f"# HELP {METRIC_NAME}_recent Percentiles of each stage's last {self.samples} durations",
+            f"# TYPE {METRIC_NAME}_recent gauge"
+        ]
+        for stage, stage_stats in sorted(self.stats().items()):
+            for name, fraction in QUANTILES:
+                lines.append(f'{METRIC_NAME}_recent{{stage="{stage}",quantile="{fraction:g}"}} {stage_stats[name]:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def write_metrics_file(self, path=LATENCY_METRICS_FILE):
+        """Atomically rewrite the Prometheus text file, if a path is configured"""
+        if not path:
+            return
+        try:
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing latency metrics: {str(e)}")
+
+
+latency_stats = LatencyStats()
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one occurrence of stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        latency_stats.record(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def trace():
+    """Collect the spans recorded in this context (one chat turn) into a Trace"""
+    turn = Trace()
+    token = _current_trace.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    """The Trace of the chat turn being run, or None outside one"""
+    return _current_trace.get()
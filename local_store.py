@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+import tempfile
+import getpass
+import sqlite3
+import os
+
+# Prompts and responses are private, so default stores live in a directory only this user can read
+PRIVATE_DIR = os.path.join(tempfile.gettempdir(), f'datacharts-{getpass.getuser()}')
+
+
+def create_private(path):
+    """Create path, and its directory, readable by their owner only
+
+    SQLite gives its journal files the database's permissions, so a store
+    created here stays private.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+    os.chmod(path, 0o600)
+
+
+@contextmanager
+def connect(path, prepare):
+    """A SQLite connection for one call: prepare(con) runs first and the block commits or rolls back
+
+    A connection per call keeps a store safe to use from any Streamlit thread.
+    """
+    con = sqlite3.connect(path, timeout=5)
+    try:
+        with con:
+            prepare(con)
+            yield con
+    finally:
+        con.close()
@@ -0,0 +1,239 @@
+from local_store import PRIVATE_DIR, connect, create_private
+import threading
+import logging
+import sqlite3
+import time
+import json
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+LOG_STORE_PATH = os.getenv('LOG_STORE_PATH', os.path.join(PRIVATE_DIR, 'llm_logs.sqlite3'))
+# Entries older than this, and the oldest entries beyond the size budget, are dropped
+LOG_RETENTION_DAYS = float(os.getenv('LOG_RETENTION_DAYS', '30'))
+LOG_STORE_MAX_MB = float(os.getenv('LOG_STORE_MAX_MB', '256'))
+# Appends between retention checks
+LOG_PRUNE_EVERY = 100
+# Characters of prompt and response kept with each entry for listing; full bodies are read on request
+LOG_PREVIEW_CHARS = 2000
+
+
+def _text_query(text):
+    # Each word of the filter as a quoted prefix term, so user input can't break FTS5 query syntax
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in text.split())
+
+
+class LogStore:
+    """Append-only SQLite store of LLM interactions from every session
+
+    Entries are tagged with the session that made them; callers scope
+    reads and deletes to that session. The file is created readable by
+    its owner only. Listing reads only a page of entries and the first preview_chars of
+    their prompt and response; full bodies are read one entry at a time.
+    Prompts and responses are indexed for text search with FTS5 when the
+    SQLite build has it, and with LIKE scans otherwise.
+    """
+
+    def __init__(self, path=LOG_STORE_PATH, retention_days=LOG_RETENTION_DAYS,
+                 max_bytes=int(LOG_STORE_MAX_MB * 1024 * 1024), preview_chars=LOG_PREVIEW_CHARS):
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self.max_bytes = max_bytes
+        self.preview_chars = preview_chars
+        self._lock = threading.Lock()
+        self._appends = 0
+        self._ready = False
+        self._fts = False
+
+    def _connect(self):
+        if not self._ready:
+            create_private(self.path)
+        return connect(self.path, self._prepare)
+
+    def _prepare(self, con):
+        if self._ready:
+            return
+        con.execute("""CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created REAL NOT NULL,
+            session_id TEXT,
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL,
+            chart_specs TEXT,
+            cache TEXT,
+            size INTEGER NOT NULL,
+            spans TEXT
+        )""")
+        columns = {row[1] for row in con.execute("PRAGMA table_info(logs)")}
+        if "spans" not in columns:
+            # Stores created before stage timings were logged
+            con.execute("ALTER TABLE logs ADD COLUMN spans TEXT")
+        con.execute("CREATE INDEX IF NOT EXISTS logs_created ON logs (created)")
+        con.execute("CREATE INDEX IF NOT EXISTS logs_session ON logs (session_id, created)")
+        try:
+            # External-content index kept in step with the logs table by triggers
+            con.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS logs_text
+                USING fts5(prompt, response, content='logs', content_rowid='id')""")
+            con.execute("""CREATE TRIGGER IF NOT EXISTS logs_text_insert AFTER INSERT ON logs BEGIN
+                INSERT INTO logs_text (rowid, prompt, response) VALUES (new.id, new.prompt, new.response);
+            END""")
+            con.execute("""CREATE TRIGGER IF NOT EXISTS logs_text_delete AFTER DELETE ON logs BEGIN
+                INSERT INTO logs_text (logs_text, rowid, prompt, response)
+                VALUES ('delete', old.id, old.prompt, old.response);
+            END""")
+            self._fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite has no FTS5, log text filters will scan the logs")
+        self._ready = True
+
+    def append(self, prompt, response, chart_specs=None, cache=None, session_id=None, spans=None):
+        """Store one interaction and return its id, or None if it could not be written
+
+        spans maps stage names to seconds spent in them during the turn.
+        """
+        prompt = prompt or ""
+        response = response if isinstance(response, str) else str(response or "")
+        specs = json.dumps(chart_specs, default=str) if chart_specs is not None else None
+        size = len(prompt.encode()) + len(response.encode()) + len((specs or "").encode())
+        with self._lock:
+            self._appends += 1
+            prune = self._appends % LOG_PRUNE_EVERY == 1
+        try:
+            with self._connect() as con:
+                entry_id = con.execute(
+                    "INSERT INTO logs (created, session_id, prompt, response, chart_specs, cache, size, spans) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), session_id, prompt, response, specs, cache, size,
+                     json.dumps(spans) if spans else None)
+                ).lastrowid
+                if prune:
+                    self._prune(con)
+                return entry_id
+        except sqlite3.Error as e:
+            logger.error(f"Error writing LLM log: {str(e)}")
+            return None
+
+    def set_spans(self, entry_id, spans):
+        """Replace an entry's stage timings once the whole turn has been timed"""
+        if entry_id is None:
+            return
+        try:
+            with self._connect() as con:
+                con.execute("UPDATE logs SET spans = ? WHERE id = ?", (json.dumps(spans), entry_id))
+        except sqlite3.Error as e:
+            logger.error(f"Error writing LLM log timings: {str(e)}")
+
+    def _prune(self, con):
+        # Rotation: drop expired entries, then the oldest ones until the store fits its budget
+        con.execute("DELETE FROM logs WHERE created < ?", (time.time() - self.retention,))
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM logs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cutoff = None
+        for entry_id, size in con.execute("SELECT id, size FROM logs ORDER BY id"):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            cutoff = entry_id
+        if cutoff is not None:
+            con.execute("DELETE FROM logs WHERE id <= ?", (cutoff,))
+            logger.info(f"Rotated LLM logs up to entry {cutoff}")
+
+    def _where(self, session_id=None, text=None, since=None, until=None):
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if since is not None:
+            clauses.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created < ?")
+            params.append(until)
+        if text and text.strip():
+            if self._fts:
+                clauses.append("id IN (SELECT rowid FROM logs_text WHERE logs_text MATCH ?)")
+                params.append(_text_query(text))
+            else:
+                clauses.append("(prompt LIKE ? OR response LIKE ?)")
+                params.extend([f"%{text.strip()}%"] * 2)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, **filters):
+        """Number of entries matching the filters taken by page()"""
+        try:
+            with self._connect() as con:
+                where, params = self._where(**filters)
+                return con.execute(f"SELECT COUNT(*) FROM logs{where}", params).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Error reading LLM logs: {str(e)}")
+            return 0
+
+    def page(self, page=0, page_size=20, session_id=None, text=None, since=None, until=None):
+        """One page of entries, newest first, with prompt and response cut to preview_chars
+
+        Entries have "prompt_truncated"/"response_truncated" set when the
+        full text is longer; body() reads it. since and until are epoch
+        seconds and text matches words in the prompt or response.
+        """
+        limit = self.preview_chars
+        try:
+            with self._connect() as con:
+                # After connecting, so the first call knows whether the text index exists
+                where, params = self._where(session_id, text, since, until)
+                rows = con.execute(
+                    f"""SELECT id, created, session_id, substr(prompt, 1, ?), length(prompt),
+                               substr(response, 1, ?), length(response), chart_specs, cache, spans
+                        FROM logs{where} ORDER BY id DESC LIMIT ? OFFSET ?""",
+                    [limit, limit] + params + [page_size, page * page_size]
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading LLM logs: {str(e)}")
+            return []
+        return [
+            {
+                "id": entry_id,
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)),
+                "session_id": session_id,
+                "prompt": prompt,
+                "prompt_truncated": prompt_length > limit,
+                "response": response,
+                "response_truncated": response_length > limit,
+                "chart_specs": json.loads(specs) if specs else None,
+                "cache": cache,
+                "spans": json.loads(spans) if spans else None
+            }
+            for (entry_id, created, session_id, prompt, prompt_length, response, response_length, specs, cache,
+                 spans) in rows
+        ]
+
+    def body(self, entry_id, session_id=None):
+        """Full (prompt, response) of one entry, or (None, None) if it has been rotated out
+
+        With a session_id, entries made by other sessions are not returned.
+        """
+        try:
+            with self._connect() as con:
+                where, params = self._where(session_id)
+                row = con.execute(
+                    f"SELECT prompt, response FROM logs{where}{' AND' if where else ' WHERE'} id = ?",
+                    params + [entry_id]
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading LLM log: {str(e)}")
+            row = None
+        return tuple(row) if row else (None, None)
+
+    def clear(self, session_id):
+        """Delete one session's entries; other sessions' entries are only removed by rotation"""
+        if session_id is None:
+            return
+        try:
+            with self._connect() as con:
+                con.execute("DELETE FROM logs WHERE session_id = ?", (session_id,))
+        except sqlite3.Error as e:
+            logger.error(f"Error clearing LLM logs: {str(e)}")
+
+
+log_store = LogStore()
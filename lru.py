@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """Thread-safe mapping that drops its least recently used entries
+
+    Bounded by max_entries, by max_bytes of the sizes given to put(), or
+    both. An entry larger than max_bytes on its own is not stored.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it recently used, or default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes=0):
+        """Store a value and return the (key, nbytes) pairs evicted to make room for it"""
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return []
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            evicted = []
+            while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                old_key, (_, old_bytes) = self._entries.popitem(last=False)
+                self._bytes -= old_bytes
+                evicted.append((old_key, old_bytes))
+            return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def keys(self):
+        """Keys from least to most recently used"""
+        with self._lock:
+            return list(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,27 +1,142 @@
 import streamlit as st
+import pandas as pd
+from datetime import datetime, timedelta
+import math
+import os
+from response_cache import response_cache
+from gateway_scheduler import gateway_scheduler
+from gateway import circuit_breaker
+from run_timing import run_timings
+from log_store import log_store
+from latency import latency_stats
+from chat_handler import current_session_id
+
+# Interactions shown per page of the log list
+LOGS_PAGE_SIZE = int(os.getenv("LOGS_PAGE_SIZE", "20"))
+# Lets the Logs page show every session's interactions; only for deployments where all users are admins
+LOGS_ADMIN_VIEW = os.getenv("LOGS_ADMIN_VIEW", "false").lower() == "true"
 
 def show_logs():
     st.title("LLM Interaction Logs")
     
-    if "llm_logs" in st.session_state and st.session_state.llm_logs:
-        # Add clear logs button
-        if st.button("🗑️ Clear Logs", use_container_width=True):
-            st.session_state.llm_logs = []
+    # Response cache counters are per process, shared by every session
+    cache_stats = response_cache.stats()
+    hit_col, disk_col, miss_col, size_col = st.columns(4)
+    hit_col.metric("Cache hits (memory)", cache_stats["memory_hits"])
+    disk_col.metric("Cache hits (disk)", cache_stats["disk_hits"])
+    miss_col.metric("Cache misses", cache_stats["misses"])
+    size_col.metric("Cached responses", f"{cache_stats['disk_entries']:,}")
+    
+    # Gateway admission: calls running and queued right now, and recent queue waits
+    queue_stats = gateway_scheduler.stats()
+    flight_col, queue_col, wait_col, coalesced_col = st.columns(4)
+    flight_col.metric("Gateway calls in flight", f"{queue_stats['in_flight']} / {queue_stats['max_concurrent']}")
+    queue_col.metric("Queued calls", queue_stats["queued"])
+    wait_col.metric("Queue wait p50 / p95", f"{queue_stats['wait_p50']:.1f}s / {queue_stats['wait_p95']:.1f}s")
+    coalesced_col.metric("Coalesced requests", queue_stats["coalesced"])
+    st.caption(f"Gateway circuit: {circuit_breaker.state.replace('_', ' ')}")
+    
+    # Script run times in this process: the first (cold) run and recent reruns, split by phase
+    timing_stats = run_timings.stats()
+    cold_col, import_col, rerun_col, runs_col = st.columns(4)
+    cold_col.metric("Cold start", f"{timing_stats['cold_start'].get('total', 0.0):.2f}s")
+    import_col.metric("Imports (cold start)", f"{timing_stats['cold_start'].get('imports', 0.0):.2f}s")
+    rerun_col.metric(
+        "Rerun p50 / p95",
+        f"{timing_stats['rerun_p50'].get('total', 0.0):.2f}s / {timing_stats['rerun_p95'].get('total', 0.0):.2f}s"
+    )
+    runs_col.metric("Reruns measured", timing_stats["reruns"])
+    with st.expander("Run time by phase"):
+        st.dataframe(
+            pd.DataFrame({
+                "Cold start (s)": timing_stats["cold_start"],
+                "Rerun p50 (s)": timing_stats["rerun_p50"],
+                "Rerun p95 (s)": timing_stats["rerun_p95"]
+            }).round(3),
+            use_container_width=True
+        )
+    
+    # Where chat turns, exports and uploads spend their time, across every session in this process
+    stage_stats = latency_stats.stats()
+    with st.expander("Stage latency"):
+        if stage_stats:
+            st.dataframe(
+                pd.DataFrame.from_dict(stage_stats, orient="index")[["count", "p50", "p95", "p99", "max", "mean"]]
+                .sort_values("p95", ascending=False).round(3),
+                use_container_width=True
+            )
+        else:
+            st.caption("No stages timed yet.")
+        st.download_button(
+            label="📥 Download metrics (Prometheus)",
+            data=latency_stats.prometheus_text(),
+            file_name="datacharts_metrics.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+    
+    # Logs are read from the persistent store a page at a time, and only this session's unless in admin view
+    session_id = current_session_id()
+    filter_col, scope_col = st.columns([3, 1])
+    text_filter = filter_col.text_input(
+        "Filter logs", placeholder="Words in the prompt or response", key="logs_filter")
+    all_sessions = LOGS_ADMIN_VIEW and scope_col.toggle("All sessions", key="logs_all_sessions")
+    if session_id is None and not all_sessions:
+        st.info("No logs available yet. Start chatting with your data to see the interaction logs!")
+        return
+    dates = st.date_input("Date range", value=(), key="logs_dates")
+    filters = {
+        "session_id": None if all_sessions else session_id,
+        "text": text_filter,
+        "since": datetime.combine(dates[0], datetime.min.time()).timestamp() if len(dates) > 0 else None,
+        "until": datetime.combine(dates[1] + timedelta(days=1), datetime.min.time()).timestamp()
+        if len(dates) > 1 else None
+    }
+    total = log_store.count(**filters)
+    
+    if total:
+        # Add clear logs button; it only ever removes this session's entries
+        if st.button("🗑️ Clear My Logs" if all_sessions else "🗑️ Clear Logs", use_container_width=True):
+            log_store.clear(session_id)
             st.rerun()
+        
+        pages = math.ceil(total / LOGS_PAGE_SIZE)
+        if st.session_state.get("logs_page", 1) > pages:
+            st.session_state.logs_page = pages
+        page = st.number_input("Page", min_value=1, max_value=pages, key="logs_page")
+        st.caption(f"{total:,} matching interactions, page {page} of {pages}")
             
         # Display logs in reverse chronological order
-        for log in reversed(st.session_state.llm_logs):
-            with st.expander(f"🕒 {log['timestamp']} - {log['prompt'][:50]}..."):
+        for log in log_store.page(page - 1, LOGS_PAGE_SIZE, **filters):
+            cache_label = {"memory": " ⚡ cached", "disk": " ⚡ cached (disk)"}.get(log.get('cache'), "")
+            with st.expander(f"🕒 {log['timestamp']} - {log['prompt'][:50]}...{cache_label}"):
+                prompt, response = log['prompt'], log['response']
+                truncated = log['prompt_truncated'] or log['response_truncated']
+                # Long bodies are only read from the store when asked for
+                if truncated and st.toggle("Show full text", key=f"log_full_{log['id']}"):
+                    full_prompt, full_response = log_store.body(log['id'], filters["session_id"])
+                    prompt, response = full_prompt or prompt, full_response or response
+                    truncated = False
+                
                 st.markdown("### 🗣️ User Prompt")
-                st.code(log['prompt'], language="markdown")
+                st.code(prompt, language="markdown")
                 
                 st.markdown("### 🤖 Assistant Response")
-                st.code(log['response'], language="markdown")
+                st.code(response, language="markdown")
+                if truncated:
+                    st.caption(f"Showing the first {log_store.preview_chars:,} characters.")
                 
                 if log.get('chart_specs'):
                     st.markdown("### 📊 Chart Specifications")
                     st.json(log['chart_specs'])
                 
+                if log.get('spans'):
+                    st.markdown("### ⏱️ Timing")
+                    st.caption(" · ".join(
+                        f"{stage} {seconds:.2f}s"
+                        for stage, seconds in sorted(log['spans'].items(), key=lambda item: -item[1])
+                    ))
+                
                 st.divider()
     else:
-        st.info("No logs available yet. Start chatting with your data to see the interaction logs!") 
\ No newline at end of file
+        st.info("No logs available yet. Start chatting with your data to see the interaction logs!")
@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from lru import LRUCache
+import pandas as pd
+import numpy as np
+import threading
+import logging
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# HyperLogLog precision: 2**12 registers, about 1.6% standard error
+HLL_PRECISION = 12
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '64'))
+PROFILE_WORKERS = int(os.getenv('PROFILE_WORKERS', '2'))
+
+
+def _column_hashes(series):
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+
+def hll_estimate(hashes, precision=HLL_PRECISION):
+    """Estimate the number of distinct 64-bit hashes with a HyperLogLog sketch"""
+    m = 1 << precision
+    if len(hashes) == 0:
+        return 0
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    remainder = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # Position of the leftmost 1-bit in the remaining bits; frexp gives bit length
+    bit_length = np.frexp(remainder.astype(np.float64))[1]
+    rank = (64 - precision) - bit_length + 1
+    # Per-register maximum rank: count (register, rank) pairs, then take the highest rank seen
+    seen = np.bincount(index * 64 + rank, minlength=m * 64).reshape(m, 64) > 0
+    registers = 63 - np.argmax(seen[:, ::-1], axis=1)
+    registers[~seen.any(axis=1)] = 0
+
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        # Small range correction (linear counting)
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _min_max(series):
+    if series.dtype.kind in "iufmM" or (
+            isinstance(series.dtype, pd.CategoricalDtype) and series.cat.ordered):
+        if series.notna().any():
+            return series.min(), series.max()
+    return None, None
+
+
+def _iter_columns(df):
+    # ColumnarDatasets load one column at a time so profiling stays within memory
+    for col in df.columns:
+        yield col, df[col]
+
+
+def quick_profile(dataset):
+    """Profile a ColumnarDataset from its metadata without loading its columns
+
+    Row and column counts, nulls, min and max come from the file; distinct
+    counts and duplicate rows are left as None for the full profile to fill in.
+    """
+    statistics = dataset.column_statistics()
+    column_stats = [
+        {
+            "column": col,
+            "dtype": str(dataset.dtypes[col]),
+            "nulls": nulls,
+            "distinct": None,
+            "min": col_min,
+            "max": col_max
+        }
+        for col, (nulls, col_min, col_max) in statistics.items()
+    ]
+    nulls = [stat["nulls"] for stat in column_stats]
+    return {
+        "rows": len(dataset),
+        "columns": len(dataset.columns),
+        "missing": None if None in nulls else sum(nulls),
+        "duplicates": None,
+        "exact": False,
+        "partial": True,
+        "column_stats": column_stats
+    }
+
+
+def profile_dataset(df, exact=False):
+    """Profile a dataset in one pass over its columns
+
+    The approximate profile hashes each column once; the hashes feed a
+    HyperLogLog distinct count and are folded into per-row hashes whose
+    repeats estimate duplicate rows. The exact profile uses nunique and a
+    full duplicate-row check instead.
+    """
+    rows = len(df)
+    column_stats = []
+    row_hashes = np.zeros(rows, dtype=np.uint64)
+
+    for col, series in _iter_columns(df):
+        nulls = int(series.isna().sum())
+        if exact:
+            distinct = int(series.nunique())
+        else:
+            hashes = _column_hashes(series)
+            distinct = hll_estimate(hashes[series.notna().to_numpy()])
+            row_hashes = row_hashes * np.uint64(1000003) ^ hashes
+        col_min, col_max = _min_max(series)
+        column_stats.append({
+            "column": col,
+            "dtype": str(series.dtype),
+            "nulls": nulls,
+            "distinct": distinct,
+            "min": col_min,
+            "max": col_max
+        })
+
+    if exact:
+        if hasattr(df, "duplicate_count"):
+            duplicates = df.duplicate_count()
+        else:
+            duplicates = int(df.duplicated().sum())
+    else:
+        duplicates = rows - len(pd.unique(row_hashes)) if rows and len(df.columns) else 0
+
+    return {
+        "rows": rows,
+        "columns": len(df.columns),
+        "missing": sum(stat["nulls"] for stat in column_stats),
+        "duplicates": int(duplicates),
+        "exact": exact,
+        "partial": False,
+        "column_stats": column_stats
+    }
+
+
+class ProfileCache:
+    """Caches dataset profiles by fingerprint and computes the slow ones in the background
+
+    Exact profiles are always computed in the background. So are the
+    approximate profiles of ColumnarDatasets, which would otherwise load
+    every column on the rerun that opened them; their metadata answers
+    in the meantime.
+    """
+
+    def __init__(self, max_entries=PROFILE_CACHE_SIZE, workers=PROFILE_WORKERS):
+        self.max_entries = max_entries
+        self._profiles = LRUCache(max_entries)  # (fingerprint, exact) -> profile
+        self._quick = LRUCache(max_entries)     # fingerprint -> metadata profile of a ColumnarDataset
+        self._pending = {}              # (fingerprint, exact) -> Future for a background profile
+        self._failed = set()            # (fingerprint, exact) keys whose background profile raised
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="profile")
+
+    def get(self, fingerprint, df):
+        """Return the approximate profile, computing it on first use
+
+        For a ColumnarDataset the profile is computed in the background and
+        a partial one read from the file's metadata is returned until then.
+        """
+        key = (fingerprint, False)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            return profile
+        if not hasattr(df, "column_statistics"):
+            profile = profile_dataset(df)
+            self._profiles.put(key, profile)
+            return profile
+        self._submit(key, df)
+        quick = self._quick.get(fingerprint)
+        if quick is None:
+            quick = quick_profile(df)
+            self._quick.put(fingerprint, quick)
+        return quick
+
+    def get_exact(self, fingerprint, df):
+        """Return the exact profile if it is ready, otherwise start it in the background and return None"""
+        key = (fingerprint, True)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            return profile
+        self._submit(key, df)
+        return None
+
+    def _submit(self, key, df):
+        with self._lock:
+            if key not in self._pending and key not in self._failed:
+                self._pending[key] = self._executor.submit(self._compute, key, df)
+
+    def is_pending(self, fingerprint, exact=True):
+        """Whether the exact (or approximate) profile for this dataset is still being computed"""
+        with self._lock:
+            return (fingerprint, exact) in self._pending
+
+    def wait(self, fingerprint, exact=True, timeout=None):
+        """Wait up to timeout seconds for a background profile; return whether it is still pending"""
+        with self._lock:
+            future = self._pending.get((fingerprint, exact))
+        if future is None:
+            return False
+        wait([future], timeout)
+        return self.is_pending(fingerprint, exact)
+
+    def _compute(self, key, df):
+        fingerprint, exact = key
+        try:
+            self._profiles.put(key, profile_dataset(df, exact=exact))
+            if not exact:
+                self._quick.pop(fingerprint)
+        except Exception as e:
+            logger.error(f"Error computing {'exact' if exact else 'approximate'} profile: {str(e)}")
+            with self._lock:
+                self._failed.add(key)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,114 @@
+from profiling import profile_cache, profile_dataset
+from lru import LRUCache
+import os
+
+# Rough budget for the dataset description sent with every chat turn
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv('PROMPT_CONTEXT_TOKEN_BUDGET', '1500'))
+# Representative values are taken from this many leading rows of each column
+EXAMPLE_SCAN_ROWS = 1000
+EXAMPLES_PER_COLUMN = 3
+SAMPLE_ROWS = 3
+MAX_VALUE_CHARS = 40
+CONTEXT_CACHE_SIZE = 64
+
+_context_cache = LRUCache(CONTEXT_CACHE_SIZE)  # (fingerprint, budget) -> context text
+
+
+def estimate_tokens(text):
+    """Cheap token estimate, about four characters per token"""
+    return len(text) // 4 + 1
+
+
+def _short(value):
+    text = f"{value:.6g}" if isinstance(value, float) else str(value)
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS - 3] + "..."
+
+
+def _format_count(count, exact):
+    # None while a dataset's full profile is still being computed
+    if count is None:
+        return "?"
+    return f"{count:,}" if exact else f"~{count:,}"
+
+
+def _examples(series):
+    return series.dropna().astype(str).value_counts().index[:EXAMPLES_PER_COLUMN].tolist()
+
+
+def _column_line(stat, examples, exact, with_examples):
+    parts = [
+        str(stat["column"]),
+        stat["dtype"],
+        f"{_format_count(stat['distinct'], exact)} distinct",
+        f"{_format_count(stat['nulls'], True)} null"
+    ]
+    if stat["min"] is not None:
+        parts.append(f"range {_short(stat['min'])} .. {_short(stat['max'])}")
+    elif with_examples and examples:
+        parts.append("e.g. " + ", ".join(f'"{_short(value)}"' for value in examples))
+    return "- " + " | ".join(parts)
+
+
+def build_dataset_context(df, profile=None, token_budget=PROMPT_CONTEXT_TOKEN_BUDGET):
+    """Describe a dataset compactly for the LLM, trimmed to token_budget
+
+    Each column gets its dtype, distinct and null counts, and either its
+    range or a few common values. When the text is over budget, sample rows
+    go first, then example values, then trailing columns are listed by name
+    only, and finally dropped with a count.
+    """
+    if profile is None:
+        profile = profile_dataset(df)
+    header = f"Dataset: {profile['rows']:,} rows x {profile['columns']:,} columns"
+    column_header = "Columns (name | type | distinct | nulls | range or common values):"
+    stats = profile["column_stats"]
+    # One read of the leading rows serves the sample rows and every column's examples
+    sample = df.head(EXAMPLE_SCAN_ROWS)
+    head = sample.head(SAMPLE_ROWS)
+    examples = {stat["column"]: _examples(sample[stat["column"]]) for stat in stats if stat["min"] is None}
+
+    def render(with_samples, with_examples, detailed_columns, named_columns):
+        lines = [header, column_header]
+        for stat in stats[:detailed_columns]:
+            lines.append(_column_line(stat, examples.get(stat["column"]), profile["exact"], with_examples))
+        names = [str(stat["column"]) for stat in stats[detailed_columns:named_columns]]
+        if names:
+            lines.append("More columns: " + ", ".join(names))
+        if named_columns < len(stats):
+            lines.append(f"... and {len(stats) - named_columns:,} more columns not listed")
+        if with_samples and len(head):
+            lines.append("Sample rows:")
+            lines.append(head.to_csv(index=False).strip())
+        return "\n".join(lines)
+
+    n = len(stats)
+    for with_samples, with_examples in ((True, True), (False, True), (False, False)):
+        text = render(with_samples, with_examples, n, n)
+        if estimate_tokens(text) <= token_budget:
+            return text
+
+    # Still over budget: keep details for as many leading columns as fit, name the rest
+    detailed = n
+    while detailed > 0 and estimate_tokens(render(False, False, detailed, n)) > token_budget:
+        detailed = detailed // 2
+    named = n
+    while named > detailed and estimate_tokens(render(False, False, detailed, named)) > token_budget:
+        named = detailed + (named - detailed) // 2
+    return render(False, False, detailed, named)
+
+
+def get_dataset_context(df, fingerprint=None, token_budget=PROMPT_CONTEXT_TOKEN_BUDGET):
+    """Return the dataset context, built once per dataset fingerprint and budget"""
+    if fingerprint is None:
+        return build_dataset_context(df, token_budget=token_budget)
+    key = (fingerprint, token_budget)
+    context = _context_cache.get(key)
+    if context is not None:
+        return context
+    profile = profile_cache.get(fingerprint, df)
+    context = build_dataset_context(df, profile, token_budget)
+    if profile["partial"]:
+        # Rebuilt with distinct counts once the background profile lands
+        return context
+    _context_cache.put(key, context)
+    return context
@@ -0,0 +1,106 @@
+from ingest import ColumnarDataset, SPILL_DIR
+import threading
+import logging
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', '1000'))
+QUERY_TIMEOUT_SECONDS = float(os.getenv('QUERY_TIMEOUT_SECONDS', '30'))
+QUERY_MEMORY_LIMIT = os.getenv('QUERY_MEMORY_LIMIT', '1GB')
+QUERY_THREADS = int(os.getenv('QUERY_THREADS', '4'))
+# Rows of a query result written into the chat response
+QUERY_DISPLAY_ROWS = 20
+
+# Name the uploaded dataset is queried under
+TABLE_NAME = "data"
+
+
+class QueryError(Exception):
+    """Raised when a query is rejected, fails, or runs past its time limit"""
+
+
+def is_query_spec(obj):
+    """Check that a decoded JSON value is a query request from the LLM"""
+    return isinstance(obj, dict) and isinstance(obj.get("query"), str) and obj["query"].strip() != ""
+
+
+def _validate(duckdb, sql):
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as e:
+        raise QueryError(f"Could not parse query: {str(e)}")
+    if len(statements) != 1:
+        raise QueryError("Only a single SELECT statement is allowed")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise QueryError("Only read-only SELECT queries are allowed")
+    return statements[0].query
+
+
+def _source(df):
+    # Parquet is scanned lazily so only the queried columns and row groups are read
+    if isinstance(df, ColumnarDataset):
+        return df.arrow_dataset()
+    return df
+
+
+def run_query(sql, df, max_rows=QUERY_MAX_ROWS, timeout=QUERY_TIMEOUT_SECONDS):
+    """Run a read-only SQL query against the dataset (as table "data") and return (result, truncated)
+
+    The query runs in its own in-memory DuckDB connection with file access
+    disabled, a memory limit that spills to SPILL_DIR, and an interrupt
+    after timeout seconds. At most max_rows rows are returned.
+    """
+    import duckdb
+
+    query = _validate(duckdb, sql)
+    con = duckdb.connect(":memory:")
+    try:
+        con.register(TABLE_NAME, _source(df))
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        con.execute(f"SET memory_limit='{QUERY_MEMORY_LIMIT}'")
+        con.execute(f"SET threads={QUERY_THREADS}")
+        con.execute(f"SET temp_directory='{os.path.join(SPILL_DIR, 'duckdb')}'")
+        con.execute("SET enable_external_access=false")
+        con.execute("SET lock_configuration=true")
+
+        timer = threading.Timer(timeout, con.interrupt)
+        timer.start()
+        try:
+            result = con.execute(f"SELECT * FROM ({query}) AS result LIMIT {max_rows + 1}").fetch_df()
+        except duckdb.InterruptException:
+            raise QueryError(f"Query took longer than {timeout:g} seconds and was stopped")
+        except duckdb.Error as e:
+            raise QueryError(str(e))
+        finally:
+            timer.cancel()
+    finally:
+        con.close()
+
+    truncated = len(result) > max_rows
+    return result.head(max_rows), truncated
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:,.6g}"
+    return str(value)
+
+
+def format_result(result, truncated, max_rows=QUERY_DISPLAY_ROWS):
+    """Render a query result as a markdown table for the chat response"""
+    shown = result.head(max_rows)
+    header = "| " + " | ".join(str(col) for col in shown.columns) + " |"
+    divider = "| " + " | ".join("---" for _ in shown.columns) + " |"
+    rows = [
+        "| " + " | ".join(_format_value(value).replace("|", "\\|") for value in row) + " |"
+        for row in shown.itertuples(index=False)
+    ]
+    if truncated:
+        note = f"Showing the first {len(shown)} rows; the query returned more than {len(result)} rows."
+    elif len(shown) < len(result):
+        note = f"Showing the first {len(shown)} of {len(result)} rows."
+    else:
+        note = f"{len(result)} row{'s' if len(result) != 1 else ''}."
+    return "\n".join(["", "", "**Query result**", "", header, divider] + rows + ["", note])
@@ -0,0 +1,181 @@
+import threading
+import logging
+import atexit
+import queue
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# kaleido processes kept running for image export, shared by every session
+RENDERER_POOL_SIZE = int(os.getenv('RENDERER_POOL_SIZE', str(min(4, os.cpu_count() or 1))))
+# Images a process renders before it is replaced, to bound Chromium's memory growth
+RENDERER_MAX_JOBS = int(os.getenv('RENDERER_MAX_JOBS', '200'))
+RENDERER_WARM_ON_START = os.getenv('RENDERER_WARM_ON_START', 'true').lower() == 'true'
+
+# Tiny figure rendered once per process so plotly.js is loaded before real work arrives
+_WARMUP_FIGURE = {"data": [{"type": "bar", "x": [0], "y": [0]}], "layout": {}}
+
+
+class _Renderer:
+    """One kaleido process and the number of images it has rendered"""
+
+    def __init__(self):
+        import plotly.io as pio
+        from kaleido.scopes.plotly import PlotlyScope
+        # Same local plotly.js and MathJax as plotly's own scope, so no CDN is needed
+        default = pio.kaleido.scope
+        self.scope = PlotlyScope(plotlyjs=default.plotlyjs, mathjax=default.mathjax)
+        self.jobs = 0
+
+    def is_started(self):
+        return self.scope._proc is not None
+
+    def is_alive(self):
+        proc = self.scope._proc
+        return proc is not None and proc.poll() is None
+
+    def warm(self):
+        self.scope.transform(_WARMUP_FIGURE, format="png", width=10, height=10)
+
+    def warm_quietly(self):
+        try:
+            self.warm()
+        except Exception as e:
+            logger.error(f"Error warming kaleido renderer: {str(e)}")
+
+    def render(self, figure, **settings):
+        self.jobs += 1
+        return self.scope.transform(figure, **settings)
+
+    def close(self):
+        try:
+            self.scope._shutdown_kaleido()
+        except Exception as e:
+            logger.error(f"Error stopping kaleido process: {str(e)}")
+
+
+class RendererPool:
+    """Long-lived pool of warm kaleido processes for chart image export
+
+    A renderer whose process has died is replaced before use, a render that
+    fails because its process crashed is retried once on a fresh one, and
+    every process is recycled after max_jobs images.
+    """
+
+    def __init__(self, size=RENDERER_POOL_SIZE, max_jobs=RENDERER_MAX_JOBS):
+        self.size = max(size, 1)
+        self.max_jobs = max_jobs
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._warm_started = False
+        self._counts = {"renders": 0, "restarts": 0, "recycled": 0, "failures": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        renderer = self._new_renderer()
+        return renderer if renderer is not None else self._idle.get()
+
+    def _new_renderer(self):
+        # A new renderer if the pool has room for one, else None
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return _Renderer()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _replace(self, renderer, reason):
+        renderer.close()
+        self._count(reason)
+        replacement = _Renderer()
+        # Start the new process now rather than on the next export that picks it up
+        threading.Thread(target=replacement.warm_quietly, name="renderer-warmup", daemon=True).start()
+        return replacement
+
+    def _healthy(self, renderer):
+        # A renderer that was started but whose process has exited since is restarted
+        if renderer.is_started() and not renderer.is_alive():
+            logger.warning("kaleido process exited, restarting it")
+            return self._replace(renderer, "restarts")
+        return renderer
+
+    def render(self, figure, **settings):
+        """Rasterize a figure (a go.Figure or its dict) and return the image bytes"""
+        if hasattr(figure, "to_dict"):
+            figure = figure.to_dict()
+        renderer = self._acquire()
+        try:
+            renderer = self._healthy(renderer)
+            try:
+                image = renderer.render(figure, **settings)
+            except Exception:
+                if renderer.is_alive():
+                    # The figure itself failed; the process is fine
+                    self._count("failures")
+                    raise
+                logger.warning("kaleido process crashed while rendering, retrying on a new one")
+                renderer = self._replace(renderer, "restarts")
+                image = renderer.render(figure, **settings)
+            self._count("renders")
+            if renderer.jobs >= self.max_jobs:
+                renderer = self._replace(renderer, "recycled")
+            return image
+        finally:
+            self._idle.put(renderer)
+
+    def warm(self):
+        """Start and warm every renderer in the background, once per process"""
+        with self._lock:
+            if self._warm_started:
+                return
+            self._warm_started = True
+
+        def start():
+            warmed = 0
+            while True:
+                renderer = self._new_renderer()
+                if renderer is None:
+                    break
+                try:
+                    renderer.warm()
+                    warmed += 1
+                except Exception as e:
+                    logger.error(f"Error warming kaleido renderer: {str(e)}")
+                finally:
+                    # Available to exports as soon as it is ready
+                    self._idle.put(renderer)
+            logger.info(f"Warmed {warmed} kaleido renderers")
+
+        threading.Thread(target=start, name="renderer-warmup", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, size=self.size, started=self._created, idle=self._idle.qsize())
+
+    def shutdown(self):
+        """Stop every idle kaleido process"""
+        while True:
+            try:
+                renderer = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            renderer.close()
+            with self._lock:
+                self._created -= 1
+
+
+renderer_pool = RendererPool()
+atexit.register(renderer_pool.shutdown)
@@ -0,0 +1,156 @@
+from local_store import PRIVATE_DIR, connect, create_private
+from lru import LRUCache
+import threading
+import logging
+import sqlite3
+import hashlib
+import time
+import json
+import re
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv('RESPONSE_CACHE_MEMORY_ENTRIES', '256'))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join(PRIVATE_DIR, 'response_cache.sqlite3'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_MB = float(os.getenv('RESPONSE_CACHE_MAX_MB', '64'))
+
+
+def normalize_prompt(prompt):
+    """Fold case, whitespace and trailing punctuation so trivially different prompts share an entry"""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip("?!. ").lower()
+
+
+def response_key(fingerprint, model, prompt, system_prompt=""):
+    """Cache key for a chat turn
+
+    The system prompt is part of the key so a change to the instructions or
+    the dataset summary never serves an answer written for the old ones.
+    """
+    material = json.dumps([fingerprint, model, normalize_prompt(prompt), system_prompt])
+    return hashlib.blake2b(material.encode(), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of LLM responses: an in-process LRU in front of a SQLite file
+
+    Disk entries expire after ttl seconds and the least recently used ones
+    are evicted once the file holds more than max_bytes of responses. The
+    file is created readable by its owner only.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+                 ttl=RESPONSE_CACHE_TTL_SECONDS, max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory = LRUCache(memory_entries)  # key -> (response, stored_at)
+        self._lock = threading.Lock()
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._disk_ready = False
+
+    def _connect(self):
+        if not self._disk_ready:
+            create_private(self.path)
+        return connect(self.path, self._prepare)
+
+    def _prepare(self, con):
+        if not self._disk_ready:
+            con.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                model TEXT,
+                prompt TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+            con.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._disk_ready = True
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, key):
+        """Return (response, tier) for a cached turn, or (None, "miss")"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and now - entry[1] > self.ttl:
+            self._memory.pop(key)
+            entry = None
+        if entry is not None:
+            self._count("memory_hits")
+            return entry[0], "memory"
+
+        try:
+            with self._connect() as con:
+                row = con.execute(
+                    "SELECT response, created FROM responses WHERE key = ? AND created > ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    con.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.error(f"Error reading response cache: {str(e)}")
+            row = None
+        if row is None:
+            self._count("misses")
+            return None, "miss"
+        self._memory.put(key, (row[0], row[1]))
+        self._count("disk_hits")
+        return row[0], "disk"
+
+    def put(self, key, response, fingerprint=None, model=None, prompt=None):
+        """Store a response in both tiers and evict expired or excess disk entries"""
+        now = time.time()
+        self._memory.put(key, (response, now))
+        size = len(response.encode())
+        try:
+            with self._connect() as con:
+                con.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, fingerprint, model, prompt, response, size, now, now)
+                )
+                con.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+                total = con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    # Drop least recently used entries until the file is back under budget
+                    rows = con.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+                    evict = []
+                    for old_key, old_size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((old_key,))
+                        total -= old_size
+                    con.executemany("DELETE FROM responses WHERE key = ?", evict)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing response cache: {str(e)}")
+
+    def clear(self):
+        self._memory.clear()
+        try:
+            with self._connect() as con:
+                con.execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            logger.error(f"Error clearing response cache: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats["memory_entries"] = len(self._memory)
+        try:
+            with self._connect() as con:
+                stats["disk_entries"], stats["disk_bytes"] = con.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        except sqlite3.Error:
+            stats["disk_entries"], stats["disk_bytes"] = 0, 0
+        return stats
+
+
+response_cache = ResponseCache()
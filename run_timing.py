@@ -0,0 +1,72 @@
+from collections import deque
+import threading
+import logging
+import time
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Recent script reruns kept for the rerun-time percentiles
+RUN_SAMPLES = 500
+
+
+class RunTimer:
+    """Wall-clock time of one script run, split into named phases"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = {}
+
+    def mark(self, phase):
+        """Close the phase that ends now"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return self._last - self.started
+
+
+class RunTimings:
+    """Per-process record of how long the app script takes to run
+
+    The first finished run is the cold start, which includes importing the
+    app's modules; later runs are reruns, kept for percentiles.
+    """
+
+    def __init__(self, samples=RUN_SAMPLES):
+        self._cold_start = None
+        self._reruns = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def start(self):
+        return RunTimer()
+
+    def finish(self, timer):
+        """Record a run that got to the end of the script"""
+        run = dict(timer.phases, total=timer.total())
+        with self._lock:
+            cold = self._cold_start is None
+            if cold:
+                self._cold_start = run
+            else:
+                self._reruns.append(run)
+        if cold:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timer.phases.items())
+            logger.info(f"Cold start took {run['total']:.2f}s ({phases})")
+
+    def stats(self):
+        """Cold start phases and rerun p50/p95 in seconds, per phase and in total"""
+        with self._lock:
+            cold_start = dict(self._cold_start or {})
+            reruns = list(self._reruns)
+        stats = {"cold_start": cold_start, "reruns": len(reruns), "rerun_p50": {}, "rerun_p95": {}}
+        for name in dict.fromkeys(name for run in reruns for name in run):
+            values = sorted(run.get(name, 0.0) for run in reruns)
+            stats["rerun_p50"][name] = values[min(int(0.5 * len(values)), len(values) - 1)]
+            stats["rerun_p95"][name] = values[min(int(0.95 * len(values)), len(values) - 1)]
+        return stats
+
+
+run_timings = RunTimings()
@@ -0,0 +1,145 @@
+from functools import lru_cache
+import logging
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+# Files in static/ are served by Streamlit (server.enableStaticServing) under app/static/
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+FONT_FILE = "PfizerTomorrow-Regular.otf"
+FONT_PATH = os.path.join(STATIC_DIR, FONT_FILE)
+FONT_URL = f"app/static/{FONT_FILE}"
+ASSISTANT_AVATAR_PATH = os.path.join(ASSETS_DIR, "pfe-icon.png")
+
+# Hide Streamlit's chrome and style the sidebar navigation
+BASE_CSS = """
+        /* Hide main menu button and footer */
+        #MainMenu {visibility: hidden;}
+        footer {visibility: hidden;}
+
+        /* Hide top-level navigation items */
+        header {visibility: hidden;}
+
+        /* Hide default page navigation */
+        [data-testid="stSidebarNav"] {display: none;}
+
+        /* Hide the close button and its background */
+        button[kind="header"] {display: none;}
+        .st-emotion-cache-r421ms {display: none;}
+        .st-emotion-cache-1dp5vir {display: none;}
+
+        /* Ensure sidebar content is visible */
+        [data-testid="stSidebar"] {
+            visibility: visible !important;
+            height: 100% !important;
+        }
+
+        /* Ensure sidebar content is visible */
+        [data-testid="stSidebarContent"] {
+            visibility: visible !important;
+        }
+
+        /* Improve image quality */
+        img {
+            image-rendering: -webkit-optimize-contrast;
+            image-rendering: crisp-edges;
+        }
+
+        /* Center logo container */
+        .logo-container {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            padding: 1rem 0;
+        }
+
+        /* Style for navigation menu */
+        .nav-menu {
+            margin: 1rem 0;
+            padding: 0.5rem 0;
+            border-radius: 4px;
+        }
+
+        /* Style the selectbox */
+        .nav-menu .stSelectbox {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+        }
+
+        .nav-menu .stSelectbox > div > div {
+            padding: 0.5rem 1rem;
+            cursor: pointer;
+        }
+
+        .nav-menu .stRadio > label {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+            padding: 0.5rem 1rem;
+            cursor: pointer;
+        }
+
+        .nav-menu .stRadio > label:hover {
+            background-color: rgba(0, 0, 238, 0.1);
+        }
+"""
+
+# Custom font for headers, only added when the font file is present
+FONT_CSS = """
+        @font-face {
+            font-family: 'PfizerTomorrow';
+            src: url("%(font_url)s") format('opentype');
+        }
+
+        h1, h2, h3, h4, h5, h6 {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+        }
+
+        .stMarkdown h1, .stMarkdown h2, .stMarkdown h3 {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+        }
+
+        .sidebar .sidebar-content {
+            font-family: 'PfizerTomorrow', sans-serif;
+        }
+
+        .st-emotion-cache-1788y8l h1,
+        .st-emotion-cache-1788y8l h2,
+        .st-emotion-cache-1788y8l h3,
+        .st-emotion-cache-1788y8l h4 {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+        }
+
+        .custom-header {
+            font-family: 'PfizerTomorrow', sans-serif !important;
+            font-weight: normal;
+        }
+
+        .blue-header {
+            color: #0000EE;
+            font-size: 24px;
+            margin-bottom: 20px;
+            text-align: center;
+        }
+"""
+
+
+@lru_cache(maxsize=None)
+def page_css():
+    """The app's whole <style> block; the font is linked by URL so the browser fetches and caches it once"""
+    css = BASE_CSS
+    if os.path.exists(FONT_PATH):
+        css += FONT_CSS % {"font_url": FONT_URL}
+    else:
+        logger.warning(f"Font file not found: {FONT_PATH}")
+    return f"<style>{css}</style>"
+
+
+@lru_cache(maxsize=None)
+def assistant_avatar():
+    """The assistant's chat avatar as image bytes, so reruns don't read the file for every message"""
+    try:
+        with open(ASSISTANT_AVATAR_PATH, "rb") as image_file:
+            return image_file.read()
+    except OSError as e:
+        logger.error(f"Error loading avatar image: {str(e)}")
+        return None
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from chart_extractor import ChartSpecExtractor, extract_chart_specs
+
+SPEC = {"chart_type": "bar", "x_column": "country", "y_column": "count", "title": "Count by Country"}
+TRICKY = {"chart_type": "pie", "x_column": "a{b", "y_column": "c}\"d\\", "title": "Braces { } and \"quotes\" \\"}
+
+
+def _streamed(text, size):
+    extractor = ChartSpecExtractor()
+    found = []
+    for i in range(0, len(text), size):
+        found.extend(extractor.feed(text[i:i + size]))
+    return found + extractor.finish()
+
+
+def _split_everywhere(text):
+    # Every two-chunk split of the text
+    for cut in range(len(text) + 1):
+        extractor = ChartSpecExtractor()
+        yield cut, extractor.feed(text[:cut]) + extractor.feed(text[cut:]) + extractor.finish()
+
+
+def test_finds_spec_with_offsets():
+    spec_text = json.dumps(SPEC)
+    text = f"Here you go: {spec_text} and that's it."
+    found = extract_chart_specs(text)
+    assert [s.spec for s in found] == [SPEC]
+    assert text[found[0].start:found[0].end] == spec_text
+
+
+@pytest.mark.parametrize("spec", [SPEC, TRICKY])
+def test_every_chunk_boundary(spec):
+    spec_text = json.dumps(spec)
+    text = f"Intro {{not json}} then {spec_text}\nand {spec_text} done"
+    expected = [(spec, text.index(spec_text)), (spec, text.rindex(spec_text))]
+    for cut, found in _split_everywhere(text):
+        assert [(s.spec, s.start) for s in found] == expected, cut
+        assert all(text[s.start:s.end] == spec_text for s in found), cut
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_small_chunks(size):
+    text = f"a {json.dumps(TRICKY)} b {json.dumps(SPEC)}"
+    assert [s.spec for s in _streamed(text, size)] == [TRICKY, SPEC]
+
+
+def test_braces_and_escapes_inside_strings():
+    spec = dict(SPEC, title='He said "}{" \\ then \\"left\\"')
+    spec_text = json.dumps(spec)
+    assert "\\\\" in spec_text and '\\"' in spec_text
+    for cut, found in _split_everywhere(f"x {spec_text} y"):
+        assert [s.spec for s in found] == [spec], cut
+
+
+def test_invalid_objects_are_skipped():
+    text = f'{{"chart_type": "bar"}} {{broken: json}} {{"chart_type": "radar", "x_column": "a", "y_column": "b", "title": "t"}} {json.dumps(SPEC)}'
+    assert [s.spec for s in extract_chart_specs(text)] == [SPEC]
+    assert [s.spec for s in _streamed(text, 5)] == [SPEC]
+
+
+def test_spec_inside_non_json_braces():
+    text = f"foo {{bar {json.dumps(SPEC)}}} baz"
+    for cut, found in _split_everywhere(text):
+        assert [s.spec for s in found] == [SPEC], cut
+        assert text[found[0].start:found[0].end] == json.dumps(SPEC), cut
+
+
+@pytest.mark.parametrize("prefix", ['{ "', '{ say "hi ', '{ """ '])
+def test_stray_brace_with_odd_quotes(prefix):
+    text = f"{prefix}{json.dumps(SPEC)} }} tail"
+    for cut, found in _split_everywhere(text):
+        assert [s.spec for s in found] == [SPEC], cut
+
+
+def test_unclosed_brace_before_spec():
+    text = f"oops {{ never closed {json.dumps(SPEC)}"
+    for size in (1, 4, len(text)):
+        assert [s.spec for s in _streamed(text, size)] == [SPEC]
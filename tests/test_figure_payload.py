@@ -0,0 +1,47 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from figure_payload import compact_figure, figure_payload_size, round_significant
+
+
+def test_round_significant_keeps_small_values_in_wide_range():
+    rounded = round_significant(np.array([1234567.0, 3.14159265, 0.00123456789, -0.000456789123]), 6)
+    np.testing.assert_allclose(rounded, [1234570.0, 3.14159, 0.00123457, -0.000456789])
+
+
+def test_round_significant_passes_through_zero_and_non_finite():
+    rounded = round_significant(np.array([0.0, np.nan, np.inf, 2.0 / 3.0]), 3)
+    assert rounded[0] == 0.0 and np.isnan(rounded[1]) and np.isinf(rounded[2])
+    assert rounded[3] == 0.667
+
+
+def _synthetic_frame(rows=4000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "x": rng.normal(size=rows) * 1000,
+        "y": rng.normal(size=rows) / 1000,
+        "region": rng.choice(["North", "South", "East", "West"], size=rows)
+    })
+
+
+def test_compact_figure_shrinks_scatter_payload():
+    fig = px.scatter(_synthetic_frame(), x="x", y="y")
+    before = figure_payload_size(fig)
+    compact = compact_figure(copy.deepcopy(fig))
+    assert figure_payload_size(compact) < 0.7 * before
+    # Small values survive rounding
+    assert np.count_nonzero(np.asarray(compact.data[0].y)) == np.count_nonzero(np.asarray(fig.data[0].y))
+
+
+def test_compact_figure_encodes_repeated_categories():
+    fig = px.bar(_synthetic_frame(), x="region", y="y")
+    before = figure_payload_size(fig)
+    compact = compact_figure(copy.deepcopy(fig))
+    assert figure_payload_size(compact) < 0.7 * before
+    assert sorted(compact.layout.xaxis.ticktext) == ["East", "North", "South", "West"]
+    # Hover still names the category, read from the tick labels
+    assert "%{x}" in compact.data[0].hovertemplate
+    assert list(compact.layout.xaxis.tickvals) == list(range(4))
@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import gateway
+from gateway_scheduler import GatewayScheduler, _Ticket
+
+
+class FakeGateway:
+    """Local OAuth + chat endpoints whose chat replies are scripted per call"""
+
+    def __init__(self):
+        self.script = []  # (status, delay seconds) per chat call; the last entry repeats
+        self.chat_calls = 0
+        self.token_calls = 0
+        self.lock = threading.Lock()
+
+    def next_reply(self):
+        with self.lock:
+            self.chat_calls += 1
+            index = min(self.chat_calls, len(self.script)) - 1
+        return self.script[index] if self.script else (200, 0)
+
+
+@pytest.fixture
+def fake_gateway(monkeypatch):
+    fake = FakeGateway()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, headers=()):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/token":
+                with fake.lock:
+                    fake.token_calls += 1
+                self._reply(200, {"access_token": "token", "expires_in": 3600})
+                return
+            status, delay = fake.next_reply()
+            time.sleep(delay)
+            try:
+                headers = [("Retry-After", "0")] if status == 429 else []
+                self._reply(status, {"result": "ok"} if status == 200 else {"error": status}, headers)
+            except OSError:
+                pass  # The client gave up waiting
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setenv("OAUTH_TOKEN_URL", f"{base}/token")
+    monkeypatch.setenv("MULESOFT_API_URL", f"{base}/chat")
+    monkeypatch.setattr(gateway, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(gateway, "BACKOFF_MAX", 0.05)
+    monkeypatch.setattr(gateway, "circuit_breaker", gateway.CircuitBreaker(failure_threshold=2, reset_seconds=0.3))
+    monkeypatch.setattr(gateway, "token_manager", gateway.TokenManager())
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_server_errors_then_succeeds(fake_gateway):
+    fake_gateway.script = [(503, 0), (502, 0), (200, 0)]
+    assert gateway.post_to_gateway({"prompt": "retry"}) == {"result": "ok"}
+    assert fake_gateway.chat_calls == 3
+
+
+def test_retries_rate_limit(fake_gateway):
+    fake_gateway.script = [(429, 0), (200, 0)]
+    assert gateway.post_to_gateway({"prompt": "rate limit"}) == {"result": "ok"}
+    assert fake_gateway.chat_calls == 2
+
+
+def test_read_timeout_is_not_retried_for_chat(fake_gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "READ_TIMEOUT", 0.2)
+    fake_gateway.script = [(200, 1.0)]
+    with pytest.raises(requests.ReadTimeout):
+        gateway.post_to_gateway({"prompt": "slow"})
+    assert fake_gateway.chat_calls == 1
+
+
+def test_token_fetch_is_retried_after_read_timeout(fake_gateway, monkeypatch):
+    calls = []
+    real_post = requests.Session.post
+
+    def flaky_post(session, url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            raise requests.ReadTimeout("slow token endpoint")
+        return real_post(session, url, **kwargs)
+
+    monkeypatch.setattr(requests.Session, "post", flaky_post)
+    assert gateway.token_manager.get_token() == "token"
+    assert len(calls) == 2
+
+
+def test_retries_stop_at_the_call_deadline(fake_gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "MAX_RETRIES", 50)
+    fake_gateway.script = [(503, 0.2)]
+    started = time.monotonic()
+    try:
+        response = gateway._post_with_retries(gateway.os.getenv("MULESOFT_API_URL"), deadline_seconds=1.0)
+        assert response.status_code == 503
+    except requests.ReadTimeout:
+        pass  # The last attempt only had what was left of the deadline to read in
+    assert time.monotonic() - started < 1.5
+    assert fake_gateway.chat_calls < 50
+
+
+def test_circuit_opens_and_recovers(fake_gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "MAX_RETRIES", 0)
+    fake_gateway.script = [(503, 0), (503, 0), (200, 0)]
+    for prompt in ("first", "second"):
+        with pytest.raises(requests.HTTPError):
+            gateway.post_to_gateway({"prompt": prompt})
+    with pytest.raises(gateway.CircuitOpenError):
+        gateway.post_to_gateway({"prompt": "rejected"})
+    assert fake_gateway.chat_calls == 2
+    time.sleep(0.35)
+    assert gateway.post_to_gateway({"prompt": "trial"}) == {"result": "ok"}
+    assert gateway.circuit_breaker.state == "closed"
+
+
+def test_stopped_trial_call_lets_the_next_trial_through(fake_gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "MAX_RETRIES", 0)
+    fake_gateway.script = [(503, 0), (503, 0), (200, 0)]
+    for prompt in ("first", "second"):
+        with pytest.raises(requests.HTTPError):
+            gateway.post_to_gateway({"prompt": prompt})
+    time.sleep(0.35)
+
+    def stopped(*args, **kwargs):
+        raise _Stopped()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(gateway, "_post_with_retries", stopped)
+        with pytest.raises(_Stopped):
+            gateway.post_to_gateway({"prompt": "stopped trial"})
+    assert gateway.post_to_gateway({"prompt": "trial"}) == {"result": "ok"}
+    assert gateway.circuit_breaker.state == "closed"
+
+
+def _wait_for_followers(flight_count):
+    deadline = time.monotonic() + 5
+    while sum(f.followers for f in list(gateway._flights.values())) < flight_count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class _Stopped(BaseException):
+    """Stands in for Streamlit stopping the leader's script"""
+
+
+def test_follower_calls_gateway_itself_when_leader_is_stopped_while_queued(monkeypatch):
+    queued = threading.Event()
+    stop = threading.Event()
+    real_acquire = gateway.gateway_scheduler.acquire
+
+    def acquire(session_id=None, on_wait=None):
+        if session_id == "leader":
+            queued.set()
+            stop.wait(5)
+            raise _Stopped()
+        return real_acquire(session_id, on_wait)
+
+    monkeypatch.setattr(gateway.gateway_scheduler, "acquire", acquire)
+    errors, results = [], []
+
+    def lead():
+        try:
+            list(gateway._single_flight({"prompt": "queued"}, lambda: (c for c in ["leader"]), "leader"))
+        except _Stopped as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert queued.wait(5)
+    follower = threading.Thread(target=lambda: results.extend(
+        gateway._single_flight({"prompt": "queued"}, lambda: (c for c in ["follower"]), "follower")))
+    follower.start()
+    _wait_for_followers(1)
+    stop.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 1
+    assert results == ["follower"]
+    assert not gateway._flights
+
+
+def test_follower_carries_on_stream_when_leader_is_cancelled():
+    produced = []
+    next_chunk = threading.Semaphore(0)
+
+    def produce():
+        for chunk in ("a", "b", "c"):
+            next_chunk.acquire(timeout=5)
+            produced.append(chunk)
+            yield chunk
+
+    in_flight = gateway.gateway_scheduler.stats()["in_flight"]
+    leader = gateway._single_flight({"prompt": "stream"}, produce)
+    next_chunk.release()
+    assert next(leader) == "a"
+    results = []
+    follower = threading.Thread(target=lambda: results.extend(
+        gateway._single_flight({"prompt": "stream"}, lambda: (c for c in ["second call"]))))
+    follower.start()
+    _wait_for_followers(1)
+    # The leader's session goes away mid-response
+    leader.close()
+    next_chunk.release()
+    next_chunk.release()
+    follower.join(5)
+    assert results == ["a", "b", "c"]
+    assert produced == ["a", "b", "c"]
+    assert gateway.gateway_scheduler.stats()["in_flight"] == in_flight
+    assert not gateway._flights
+
+
+def test_cancelled_leader_without_followers_releases_its_slot():
+    in_flight = gateway.gateway_scheduler.stats()["in_flight"]
+    leader = gateway._single_flight({"prompt": "alone"}, lambda: (c for c in ["a", "b"]))
+    assert next(leader) == "a"
+    leader.close()
+    assert gateway.gateway_scheduler.stats()["in_flight"] == in_flight
+    assert not gateway._flights
+
+
+def test_slot_is_released_when_the_call_fails_to_start():
+    in_flight = gateway.gateway_scheduler.stats()["in_flight"]
+
+    def produce():
+        raise RuntimeError("no token")
+
+    with pytest.raises(RuntimeError):
+        list(gateway._single_flight({"prompt": "broken"}, produce))
+    assert gateway.gateway_scheduler.stats()["in_flight"] == in_flight
+    assert not gateway._flights
+
+
+def test_abandoned_granted_slot_is_not_counted_as_served():
+    scheduler = GatewayScheduler(max_concurrent=1)
+    scheduler.acquire("first")
+    queued = threading.Thread(target=scheduler.acquire, args=("second",))
+    queued.start()
+    while not scheduler.stats()["queued"]:
+        time.sleep(0.01)
+    # The first caller leaves just after its slot was granted
+    scheduler._abandon(_Ticket("first"))
+    queued.join(5)
+    stats = scheduler.stats()
+    assert (stats["served"], stats["in_flight"], stats["queued"]) == (0, 1, 0)
@@ -0,0 +1,85 @@
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import ColumnarSpill, open_columnar_upload, read_csv_optimized
+from query_engine import run_query
+
+
+def _dirty_csv():
+    rows = [f"{i},x{i % 3}" for i in range(12)] + ["oops,x1"] + [f"{i},x" for i in range(5)]
+    return "a,b\n" + "\n".join(rows) + "\n"
+
+
+def test_spill_widens_numeric_column_that_later_has_text():
+    in_memory = read_csv_optimized(io.StringIO(_dirty_csv()), chunk_rows=5)
+    spilled = read_csv_optimized(io.StringIO(_dirty_csv()), chunk_rows=5, memory_limit=1)
+    assert len(spilled) == len(in_memory) == 18
+    assert [str(v) for v in spilled["a"]] == [str(v) for v in in_memory["a"]]
+    assert spilled["a"].iloc[12] == "oops"
+
+
+def test_spill_widens_float_column_with_missing_values():
+    csv = "a,b\n1,x\n2,y\n,z\n4,w\n"
+    spilled = read_csv_optimized(io.StringIO(csv), chunk_rows=2, memory_limit=1)
+    assert spilled["a"].dtype == np.float64
+    assert spilled["a"].isna().tolist() == [False, False, True, False]
+
+
+def test_high_cardinality_text_moves_to_disk(tmp_path):
+    spill = ColumnarSpill(str(tmp_path), max_labels=10)
+    for start in range(0, 40, 8):
+        chunk = pd.DataFrame({
+            "name": [f"name_{i}" if i % 5 else None for i in range(start, start + 8)],
+            "group": pd.Series([f"g{i % 3}" for i in range(start, start + 8)], dtype="category")
+        })
+        spill.append(chunk)
+    df = spill.to_frame()
+    assert str(df["name"].dtype).startswith("large_string")
+    assert df["name"].isna().sum() == 8
+    assert df["name"].iloc[1] == "name_1" and df["name"].iloc[39] == "name_39"
+    assert isinstance(df["group"].dtype, pd.CategoricalDtype)
+    assert df["group"].tolist() == [f"g{i % 3}" for i in range(40)]
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def _parquet_bytes(rows):
+    buffer = io.BytesIO()
+    pd.DataFrame({"a": range(rows)}).to_parquet(buffer)
+    return buffer.getvalue()
+
+
+def test_columnar_uploads_are_pruned_by_size_and_age(tmp_path):
+    data = _parquet_bytes(1000)
+    budget = 2 * len(data) + 10
+    for name in ("first", "second"):
+        open_columnar_upload(_Upload(f"{name}.parquet", data), name, str(tmp_path), max_bytes=budget)
+    # Reopening marks the first copy as recently used, so the second is dropped for the third
+    os.utime(tmp_path / "second.parquet", (time.time() - 60,) * 2)
+    dataset = open_columnar_upload(_Upload("first.parquet", data), "first", str(tmp_path), max_bytes=budget)
+    open_columnar_upload(_Upload("third.parquet", data), "third", str(tmp_path), max_bytes=budget)
+    assert sorted(os.listdir(tmp_path)) == ["first.parquet", "third.parquet"]
+    assert len(dataset["a"]) == 1000
+
+    # A copy is only deleted once no open dataset reads from it
+    os.utime(tmp_path / "first.parquet", (time.time() - 7200,) * 2)
+    open_columnar_upload(_Upload("third.parquet", data), "third", str(tmp_path), max_age=3600)
+    assert sorted(os.listdir(tmp_path)) == ["first.parquet", "third.parquet"]
+    del dataset
+    open_columnar_upload(_Upload("third.parquet", data), "third", str(tmp_path), max_age=3600)
+    assert os.listdir(tmp_path) == ["third.parquet"]
+
+
+def test_query_reads_open_parquet_after_copy_is_removed(tmp_path):
+    dataset = open_columnar_upload(_Upload("data.parquet", _parquet_bytes(1000)), "data", str(tmp_path))
+    os.remove(tmp_path / "data.parquet")
+    result, _ = run_query("SELECT COUNT(*) AS n, SUM(a) AS total FROM data WHERE a >= 500", dataset)
+    assert result.values.tolist() == [[500, sum(range(500, 1000))]]
@@ -0,0 +1,12 @@
+from log_store import LogStore
+
+
+def test_first_filtered_page_uses_the_text_index(tmp_path):
+    path = str(tmp_path / "logs.sqlite3")
+    LogStore(path).append("show sales data as a bar chart", "Here is the chart", session_id="s")
+    # A fresh store, as in a new process, searching before anything else touched the file
+    store = LogStore(path)
+    entries = store.page(text="chart sales", session_id="s")
+    if store._fts:
+        assert [entry["prompt"] for entry in entries] == ["show sales data as a bar chart"]
+    assert store.count(text="chart sales", session_id="s") == len(entries)
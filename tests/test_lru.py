@@ -0,0 +1,21 @@
+from lru import LRUCache
+
+
+def test_evicts_least_recently_used_by_count():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    assert cache.put("c", 3) == [("b", 0)]
+    assert cache.keys() == ["a", "c"]
+
+
+def test_evicts_by_bytes_and_skips_oversized_entries():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", "first", 4)
+    cache.put("b", "second", 4)
+    assert cache.put("c", "third", 4) == [("a", 4)]
+    assert cache.put("huge", "too big", 11) == []
+    assert "huge" not in cache
+    assert (cache.keys(), cache.nbytes) == (["b", "c"], 8)
+    assert cache.pop("b") == "second" and cache.nbytes == 4
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest import ColumnarDataset
+from profiling import ProfileCache, profile_dataset, quick_profile
+
+
+@pytest.fixture(params=["data.parquet", "data.arrow"])
+def dataset(request, tmp_path):
+    frame = pd.DataFrame({
+        "number": np.where(np.arange(3000) % 7 == 0, np.nan, np.arange(3000.0)),
+        "text": ["a", None, "c"] * 1000,
+        "when": pd.date_range("2024-01-01", periods=3000, freq="h")
+    })
+    path = str(tmp_path / request.param)
+    if path.endswith(".parquet"):
+        frame.to_parquet(path, row_group_size=1000)
+    else:
+        frame.to_feather(path)
+    return ColumnarDataset(path)
+
+
+def test_quick_profile_matches_full_profile(dataset):
+    quick = quick_profile(dataset)
+    full = profile_dataset(dataset)
+    assert quick["partial"] and not full["partial"]
+    assert (quick["rows"], quick["columns"], quick["missing"]) == (full["rows"], full["columns"], full["missing"])
+    for quick_stat, full_stat in zip(quick["column_stats"], full["column_stats"]):
+        assert quick_stat["distinct"] is None
+        assert quick_stat["nulls"] == full_stat["nulls"]
+        assert (quick_stat["min"], quick_stat["max"]) == (full_stat["min"], full_stat["max"])
+
+
+def test_columnar_profile_is_computed_in_the_background(dataset):
+    cache = ProfileCache()
+    assert cache.get("fingerprint", dataset)["partial"]
+    assert not cache.wait("fingerprint", exact=False, timeout=10)
+    profile = cache.get("fingerprint", dataset)
+    assert not profile["partial"]
+    assert profile["duplicates"] == 0
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from wordcloud import WordCloud
+
+from lru import LRUCache
+import text_index
+from text_index import build_token_index, get_token_index
+
+ROWS = [
+    "The Cats and the cat sat on the mat.",
+    "Dogs dog DOG dogs Dogs chase cats",
+    "news new New York's glass glasses",
+    "Python python Pythons 42 it's Python's",
+    "bus buses Bu",
+    None,
+    "Cat CAT cats Mat mats"
+]
+
+
+def _process_text(rows):
+    text = " ".join(row for row in rows if row is not None)
+    return WordCloud(collocations=False).process_text(text)
+
+
+def _counts(index):
+    terms = index.top_terms(10000)
+    return dict(zip(terms["term"], terms["count"]))
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 100])
+def test_counts_match_word_cloud(chunk_rows):
+    assert _counts(build_token_index(pd.Series(ROWS), chunk_rows=chunk_rows)) == _process_text(ROWS)
+
+
+def test_subset_counts_match_word_cloud():
+    index = build_token_index(pd.Series(ROWS))
+    mask = np.array([True, False, True, False, True, False, False])
+    subset = [row for row, keep in zip(ROWS, mask) if keep]
+    assert _counts(index.subset(mask)) == _process_text(subset)
+
+
+def test_bigrams_fold_case():
+    index = build_token_index(pd.Series(["New York", "new york", "NEW YORK city"]))
+    top = index.top_terms(1, ngram=2)
+    assert top["term"].tolist() == ["new york"]
+    assert top["count"].tolist() == [3]
+
+
+def test_index_cache_is_bounded_by_bytes(monkeypatch):
+    df = pd.DataFrame({"text": ROWS * 100})
+    nbytes = build_token_index(df["text"]).nbytes
+    monkeypatch.setattr(text_index, "_index_cache", LRUCache(max_bytes=int(2.5 * nbytes)))
+    for fingerprint in ("first", "second", "third"):
+        get_token_index(df, "text", fingerprint)
+    assert [key[0] for key in text_index._index_cache.keys()] == ["second", "third"]
+    assert text_index._index_cache.nbytes == 2 * nbytes
@@ -0,0 +1,225 @@
+from functools import lru_cache
+from lru import LRUCache
+import pandas as pd
+import numpy as np
+import logging
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Rows of a text column tokenized at a time, which bounds the temporary token arrays
+TEXT_INDEX_CHUNK_ROWS = int(os.getenv('TEXT_INDEX_CHUNK_ROWS', '50000'))
+# Token positions kept for answering filtered subsets without re-tokenizing (8 bytes each)
+TEXT_INDEX_MAX_POSTINGS = int(os.getenv('TEXT_INDEX_MAX_POSTINGS', '20000000'))
+# Combined size of the cached indexes; least recently used ones are dropped past it
+TEXT_INDEX_CACHE_MB = float(os.getenv('TEXT_INDEX_CACHE_MB', '512'))
+
+# Word pattern of WordCloud.process_text; unigram counts match it with collocations off
+TOKEN_PATTERN = r"\w[\w']*"
+
+_index_cache = LRUCache(max_bytes=int(TEXT_INDEX_CACHE_MB * 1024 * 1024))  # (fingerprint, column) -> TokenIndex
+
+
+@lru_cache(maxsize=None)
+def stop_words():
+    """wordcloud's stopword list, lowercased, loaded on first use since importing wordcloud pulls in matplotlib"""
+    from wordcloud import STOPWORDS
+    return frozenset(word.lower() for word in STOPWORDS)
+
+
+def tokenize(series):
+    """Split a text Series into tokens, returned as a Series indexed by row position
+
+    Possessive 's, numbers and stopwords (in any case) are dropped. Tokens
+    keep their case; fold_terms merges case variants and plurals.
+    """
+    text = series.reset_index(drop=True).dropna().astype(str)
+    tokens = text.str.findall(TOKEN_PATTERN).explode().dropna()
+    tokens = tokens.str.replace(r"'[sS]$", "", regex=True)
+    keep = (tokens.str.len() > 0) & ~tokens.str.isdigit() & ~tokens.str.lower().isin(stop_words())
+    return tokens[keep]
+
+
+def fold_terms(words, counts):
+    """Merge token counts the way WordCloud's process_tokens does
+
+    A lowercase form ending in a single "s" is merged into its singular when
+    that also occurs, and each word is then shown in its most common case.
+    Returns (terms, counts) arrays in order of first occurrence.
+    """
+    frame = pd.DataFrame({"word": np.asarray(words, dtype=object), "count": counts})
+    frame = frame[frame["count"] > 0].reset_index(drop=True)
+    lower = frame["word"].str.lower()
+    plural = lower.str.endswith("s") & ~lower.str.endswith("ss") & lower.str[:-1].isin(set(lower))
+    frame.loc[plural, "word"] = frame.loc[plural, "word"].str[:-1]
+    # process_tokens breaks case ties by insertion order: the singular's own
+    # variants first, then those from the plural, words in order of the singular
+    frame["group"] = frame.index.to_series().where(~plural).groupby(frame["word"].str.lower()).transform("min")
+    frame["plural"] = plural
+    frame = frame.sort_values(["group", "plural"], kind="stable")
+    variants = frame.groupby("word", sort=False)["count"].sum()
+    forms = variants.groupby(variants.index.str.lower(), sort=False)
+    return forms.idxmax().to_numpy(dtype=object), forms.sum().to_numpy(dtype=np.int64)
+
+
+class TokenIndex:
+    """Unigram and bigram counts for a text column
+
+    Unigram terms are folded as WordCloud.process_text folds them with
+    collocations off. Bigrams are lowercase pairs of adjacent tokens in the
+    same row once stopwords are removed. When the column is small enough
+    the index also keeps each token's row, so counts for a subset of rows
+    come from one bincount.
+    """
+
+    def __init__(self, vocabulary, counts, bigram_counts, rows, row_ids=None, codes=None):
+        self.vocabulary = vocabulary  # pd.Index of tokens as written, position is the token code
+        self.counts = counts          # int64 array of unigram counts by code, before folding
+        self.bigram_counts = bigram_counts  # Series of counts indexed by "first second"
+        self.rows = rows
+        self._row_ids = row_ids
+        self._codes = codes
+        self._folded = None
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the index, token positions included"""
+        arrays = (self.counts, self._row_ids, self._codes)
+        return (sum(array.nbytes for array in arrays if array is not None)
+                + int(self.vocabulary.memory_usage(deep=True))
+                + int(self.bigram_counts.memory_usage(deep=True)))
+
+    def top_terms(self, n=20, ngram=1):
+        """The n most frequent terms as a DataFrame with "term" and "count" columns"""
+        if ngram == 2:
+            top = self.bigram_counts.nlargest(n)
+            return pd.DataFrame({"term": top.index.astype(str), "count": top.to_numpy()})
+        if self._folded is None:
+            self._folded = fold_terms(self.vocabulary, self.counts)
+        terms, counts = self._folded
+        order = np.argsort(-counts, kind="stable")[:n]
+        return pd.DataFrame({"term": terms[order].astype(str), "count": counts[order]})
+
+    def frequencies(self, max_words=200):
+        """Top unigram counts as a {term: count} dict for WordCloud.generate_from_frequencies"""
+        top = self.top_terms(max_words)
+        return dict(zip(top["term"], top["count"].astype(float)))
+
+    def subset(self, mask):
+        """Index for the rows where mask (a boolean array over the column) is true, or None
+
+        None means the index kept no token positions and the subset has to
+        be tokenized from the column itself.
+        """
+        if self._codes is None:
+            return None
+        mask = np.asarray(mask, dtype=bool)
+        selected = mask[self._row_ids]
+        codes = self._codes[selected]
+        row_ids = self._row_ids[selected]
+        counts = np.bincount(codes, minlength=len(self.vocabulary))
+        return TokenIndex(self.vocabulary, counts, _bigrams(self.vocabulary, codes, row_ids),
+                          int(mask.sum()), row_ids, codes)
+
+
+def _bigrams(vocabulary, codes, row_ids):
+    if len(codes) < 2:
+        return pd.Series(dtype=np.int64)
+    same_row = row_ids[1:] == row_ids[:-1]
+    pairs = codes[:-1][same_row].astype(np.int64) << 32 | codes[1:][same_row].astype(np.int64)
+    counts = pd.Series(pairs).value_counts()
+    return _name_bigrams(vocabulary, counts)
+
+
+def _name_bigrams(vocabulary, pair_counts):
+    keys = pair_counts.index.to_numpy(dtype=np.int64)
+    first = vocabulary[keys >> 32].astype(str).str.lower()
+    second = vocabulary[keys & 0xFFFFFFFF].astype(str).str.lower()
+    # Case variants of a pair are counted together
+    return pd.Series(pair_counts.to_numpy(), index=first + " " + second).groupby(level=0, sort=False).sum()
+
+
+def build_token_index(series, chunk_rows=TEXT_INDEX_CHUNK_ROWS, max_postings=TEXT_INDEX_MAX_POSTINGS):
+    """Tokenize a text column chunk by chunk into a TokenIndex
+
+    Only the vocabulary, the counts and (up to max_postings tokens) the
+    token positions are kept between chunks.
+    """
+    vocabulary = pd.Index([], dtype=object)
+    counts = np.zeros(0, dtype=np.int64)
+    pair_counts = None
+    row_chunks, code_chunks = [], []
+    postings = 0
+
+    for start in range(0, len(series), chunk_rows):
+        tokens = tokenize(series.iloc[start:start + chunk_rows])
+        if tokens.empty:
+            continue
+        codes = vocabulary.get_indexer(tokens)
+        new_tokens = pd.unique(tokens[codes < 0])
+        if len(new_tokens):
+            vocabulary = vocabulary.append(pd.Index(new_tokens, dtype=object))
+            codes = vocabulary.get_indexer(tokens)
+        codes = codes.astype(np.int32)
+        row_ids = tokens.index.to_numpy(dtype=np.int32) + np.int32(start)
+
+        counts = np.concatenate([counts, np.zeros(len(vocabulary) - len(counts), dtype=np.int64)])
+        counts += np.bincount(codes, minlength=len(vocabulary))
+
+        same_row = row_ids[1:] == row_ids[:-1]
+        pairs = codes[:-1][same_row].astype(np.int64) << 32 | codes[1:][same_row].astype(np.int64)
+        chunk_pairs = pd.Series(pairs).value_counts()
+        pair_counts = chunk_pairs if pair_counts is None else pair_counts.add(chunk_pairs, fill_value=0)
+
+        postings += len(codes)
+        if postings <= max_postings:
+            row_chunks.append(row_ids)
+            code_chunks.append(codes)
+        else:
+            row_chunks, code_chunks = None, None
+
+    bigram_counts = (_name_bigrams(vocabulary, pair_counts.astype(np.int64)) if pair_counts is not None
+                     else pd.Series(dtype=np.int64))
+    row_ids = np.concatenate(row_chunks) if row_chunks else None
+    codes = np.concatenate(code_chunks) if code_chunks else None
+    return TokenIndex(vocabulary, counts, bigram_counts, len(series), row_ids, codes)
+
+
+def get_token_index(df, column, fingerprint=None):
+    """Token index for a text column, built on first use and cached per dataset fingerprint"""
+    if fingerprint is None:
+        return build_token_index(df[column])
+    key = (fingerprint, column)
+    index = _index_cache.get(key)
+    if index is not None:
+        return index
+    index = build_token_index(df[column])
+    nbytes = index.nbytes
+    logger.info(f"Built token index for '{column}': {len(index.vocabulary):,} terms, {nbytes:,} bytes")
+    _index_cache.put(key, index, nbytes)
+    return index
+
+
+def filtered_token_index(df, column, mask, fingerprint=None):
+    """Token index for the rows of a text column selected by a boolean mask"""
+    index = get_token_index(df, column, fingerprint)
+    subset = index.subset(mask)
+    if subset is not None:
+        return subset
+    return build_token_index(df[column][np.asarray(mask, dtype=bool)])
+
+
+def filter_mask(df, column, value):
+    """Boolean mask of the rows whose column equals value, comparing text case-insensitively"""
+    series = df[column]
+    if series.dtype.kind in "iufb" and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (series == value).to_numpy()
+    return (series.astype(str).str.lower() == str(value).lower()).to_numpy()
+
+
+def token_index_for(df, column, fingerprint=None, row_filter=None):
+    """Token index for a text column, optionally limited to rows where row_filter's (column, value) matches"""
+    if row_filter is None:
+        return get_token_index(df, column, fingerprint)
+    return filtered_token_index(df, column, filter_mask(df, *row_filter), fingerprint)
@@ -1,57 +1,86 @@
-import plotly.express as px
-import plotly.graph_objects as go
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.shapes import MSO_SHAPE_TYPE
-from pptx.dml.color import RGBColor
+# plotly, python-pptx and wordcloud are imported where they are used: together they
+# take most of a second to load and many reruns need none of them
 import io
-import tempfile
 import os
 import logging
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 import base64
 import numpy as np
-from collections import Counter
 import pandas as pd
-from datetime import datetime
+from downsampling import downsample_line, downsample_scatter
+from figure_payload import compact_figure, render_mode
+from renderer_pool import renderer_pool
+from image_cache import image_cache, image_key
+from text_index import token_index_for
+from latency import span
+from concurrent.futures import ThreadPoolExecutor
+from lru import LRUCache
+import json
 
 # Set up logging for better debugging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_word_cloud(df, text_column, title):
+WORD_CLOUD_PARAMS = {
+    "width": 800,
+    "height": 400,
+    "background_color": "white",
+    "colormap": "viridis",
+    "max_words": 100,
+    "random_state": 0
+}
+# Word clouds are sent as an embedded image; WEBP is several times smaller than PNG
+WORD_CLOUD_IMAGE_FORMAT = os.getenv('WORD_CLOUD_IMAGE_FORMAT', 'WEBP')
+WORD_CLOUD_IMAGE_QUALITY = int(os.getenv('WORD_CLOUD_IMAGE_QUALITY', '85'))
+WORD_CLOUD_CACHE_SIZE = 32
+
+_word_cloud_cache = LRUCache(WORD_CLOUD_CACHE_SIZE)  # (fingerprint, column, params, format) -> data URI
+
+# Image size for exported charts; "draft" renders much faster for quick previews
+IMAGE_PRESETS = {
+    "high": {"width": 1600, "height": 900, "scale": 2},
+    "standard": {"width": 1600, "height": 900, "scale": 1},
+    "draft": {"width": 1280, "height": 720, "scale": 1}
+}
+EXPORT_IMAGE_PRESET = os.getenv('EXPORT_IMAGE_PRESET', 'high')
+
+def _word_cloud_image(frequencies):
+    from wordcloud import WordCloud
+    # A fresh WordCloud per call and no pyplot state, so sessions can render concurrently
+    wordcloud = WordCloud(**WORD_CLOUD_PARAMS).generate_from_frequencies(frequencies)
+    buffer = io.BytesIO()
+    wordcloud.to_image().save(buffer, format=WORD_CLOUD_IMAGE_FORMAT, quality=WORD_CLOUD_IMAGE_QUALITY)
+    return f"data:image/{WORD_CLOUD_IMAGE_FORMAT.lower()};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+def _word_cloud_frequencies(df, text_column, fingerprint=None, row_filter=None):
+    index = token_index_for(df, text_column, fingerprint, row_filter)
+    frequencies = index.frequencies(WORD_CLOUD_PARAMS["max_words"])
+    # WordCloud can't lay out an empty cloud
+    return frequencies or {"(no words)": 1.0}
+
+def word_cloud_source(df, text_column, fingerprint=None, row_filter=None):
+    """Encoded word-cloud image for a text column as a data URI, cached per dataset fingerprint
+
+    Word counts come from the column's token index; row_filter is an
+    optional (column, value) pair limiting the rows used.
+    """
+    if fingerprint is None:
+        return _word_cloud_image(_word_cloud_frequencies(df, text_column, row_filter=row_filter))
+    key = (fingerprint, text_column, row_filter, json.dumps(WORD_CLOUD_PARAMS, sort_keys=True), WORD_CLOUD_IMAGE_FORMAT)
+    source = _word_cloud_cache.get(key)
+    if source is not None:
+        return source
+    source = _word_cloud_image(_word_cloud_frequencies(df, text_column, fingerprint, row_filter))
+    _word_cloud_cache.put(key, source)
+    return source
+
+def generate_word_cloud(df, text_column, title, fingerprint=None, row_filter=None):
     """Generate a word cloud from text data"""
-    # Combine all text into one string
-    text = ' '.join(df[text_column].astype(str).fillna(''))
-    
-    # Generate word cloud
-    wordcloud = WordCloud(
-        width=800, 
-        height=400,
-        background_color='white',
-        colormap='viridis',
-        max_words=100
-    ).generate(text)
-    
-    # Create plotly figure
-    img_bytes = io.BytesIO()
-    plt.figure(figsize=(10, 5))
-    plt.imshow(wordcloud, interpolation='bilinear')
-    plt.axis('off')
-    plt.title(title)
-    plt.savefig(img_bytes, format='png', bbox_inches='tight', pad_inches=0)
-    plt.close()
-    
-    # Convert to base64
-    img_bytes.seek(0)
-    img_base64 = base64.b64encode(img_bytes.read()).decode()
-    
+    import plotly.graph_objects as go
     # Create plotly figure with image
     fig = go.Figure()
     fig.add_layout_image(
         dict(
-            source=f'data:image/png;base64,{img_base64}',
+            source=word_cloud_source(df, text_column, fingerprint, row_filter),
             x=0,
             y=1,
             sizex=1,
@@ -76,18 +105,31 @@ def generate_word_cloud(df, text_column, title):
     
     return fig
 
-def generate_chart(df, chart_type, x_column=None, y_column=None, title=None, text_column=None):
-    """Generate various types of charts based on the specified type"""
+def generate_chart(df, chart_type, x_column=None, y_column=None, title=None, text_column=None, color_column=None,
+                   fingerprint=None, row_filter=None):
+    """Generate various types of charts based on the specified type, one series per color_column value
+
+    fingerprint identifies the dataset so word-cloud images can be cached,
+    and row_filter limits a word cloud to rows matching a (column, value) pair.
+    """
     if chart_type == "word_cloud":
-        return generate_word_cloud(df, text_column, title)
+        return generate_word_cloud(df, text_column, title, fingerprint, row_filter)
         
+    import plotly.express as px
     try:
+        # Reduce large line and scatter charts before they are serialized to the browser
+        total_points = len(df)
+        if chart_type == "line":
+            df = downsample_line(df, x_column, y_column, group_column=color_column)
+        elif chart_type == "scatter":
+            df = downsample_scatter(df, x_column, y_column)
+        
         if chart_type == "line":
-            fig = px.line(df, x=x_column, y=y_column, title=title)
+            fig = px.line(df, x=x_column, y=y_column, color=color_column, title=title, render_mode=render_mode(len(df)))
         elif chart_type == "bar":
-            fig = px.bar(df, x=x_column, y=y_column, title=title)
+            fig = px.bar(df, x=x_column, y=y_column, color=color_column, title=title)
         elif chart_type == "scatter":
-            fig = px.scatter(df, x=x_column, y=y_column, title=title)
+            fig = px.scatter(df, x=x_column, y=y_column, color=color_column, title=title, render_mode=render_mode(len(df)))
         elif chart_type == "pie":
             fig = px.pie(df, names=x_column, values=y_column, title=title)
         else:
@@ -107,44 +149,52 @@ def generate_chart(df, chart_type, x_column=None, y_column=None, title=None, tex
             fig.update_xaxes(title_text=x_column.replace('_', ' ').title())
             fig.update_yaxes(title_text=y_column.replace('_', ' ').title())
         
-        return fig
+        if len(df) < total_points:
+            fig.add_annotation(
+                text=f"Downsampled: showing {len(df):,} of {total_points:,} points",
+                xref="paper",
+                yref="paper",
+                x=1,
+                y=1.05,
+                xanchor="right",
+                showarrow=False,
+                font=dict(size=10, color="gray")
+            )
+        
+        return compact_figure(fig)
     except Exception as e:
         logger.error(f"Error generating chart: {str(e)}")
         return None
 
-def save_chart_as_image(chart):
-    """Save Plotly chart as image and return the path"""
+def chart_to_png(chart, preset=EXPORT_IMAGE_PRESET):
+    """Rasterize a Plotly chart to PNG bytes in memory, or None if rendering fails
+
+    Images are cached by a hash of the figure and the render settings, so an
+    unchanged chart is only rendered once.
+    """
     try:
-        # Create a temporary file with a unique name
-        temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, f'chart_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.png')
-        
-        logger.info(f"Attempting to save chart as image to: {temp_path}")
-        
-        # Save the chart as a static image
-        chart.write_image(
-            temp_path,
-            format="png",
-            engine="kaleido",
-            width=1600,  # Increased resolution
-            height=900,   # Increased resolution
-            scale=2
-        )
-        
-        # Verify the file exists and has content
-        if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-            logger.info(f"Chart successfully saved to {temp_path}")
-            return temp_path
-        else:
-            logger.error("Chart file was not created or is empty")
-            return None
-            
+        settings = dict(IMAGE_PRESETS.get(preset, IMAGE_PRESETS["high"]), format="png")
+        key = image_key(chart, **settings)
+        image = image_cache.get(key)
+        if image is None:
+            image = renderer_pool.render(chart, **settings)
+            image_cache.put(key, image)
+        return image
     except Exception as e:
-        logger.error(f"Error saving chart as image: {str(e)}")
+        logger.error(f"Error rendering chart as image: {str(e)}")
         return None
 
+def render_charts(charts, preset=EXPORT_IMAGE_PRESET):
+    """Rasterize charts concurrently on the warm renderer pool and return their PNG bytes in order"""
+    if not charts:
+        return []
+    with ThreadPoolExecutor(max_workers=max(min(renderer_pool.size, len(charts)), 1)) as pool:
+        return list(pool.map(lambda chart: chart_to_png(chart, preset), charts))
+
 def add_text_to_slide(slide, text, is_title=False):
     """Add text to a slide with proper formatting"""
+    from pptx.util import Inches, Pt
+    from pptx.dml.color import RGBColor
     if is_title:
         left = Inches(0.5)
         top = Inches(0.5)
@@ -170,94 +220,104 @@ def add_text_to_slide(slide, text, is_title=False):
     
     tf.word_wrap = True
 
-def create_presentation(messages):
-    """Create a PowerPoint presentation from chat messages"""
-    prs = Presentation()
-    temp_files = []  # Keep track of temporary files
-    
+def _chart_title(chart):
     try:
+        if hasattr(chart, 'layout') and chart.layout.title and chart.layout.title.text:
+            return chart.layout.title.text
+    except Exception:
+        pass
+    return "Visualization"
+
+class PresentationBuilder:
+    """A session's PowerPoint deck, extended slide by slide as chat messages arrive
+
+    update() only renders and appends slides for messages it has not seen,
+    so exporting costs the new content rather than the whole history. The
+    saved .pptx bytes are not kept; to_bytes() writes them on each export.
+    """
+
+    def __init__(self, preset=EXPORT_IMAGE_PRESET, figures_for=None):
+        self.preset = preset
+        # Returns the figures to put on slides for an assistant message
+        self.figures_for = figures_for or self._message_charts
+        self.message_count = 0
+        from pptx import Presentation
+        self.prs = Presentation()
+        
         # Add title slide
-        title_slide = prs.slides.add_slide(prs.slide_layouts[0])
+        title_slide = self.prs.slides.add_slide(self.prs.slide_layouts[0])
         title_slide.shapes.title.text = "Data Analysis Report"
         if hasattr(title_slide.shapes, 'subtitle') and title_slide.shapes.subtitle:
             title_slide.shapes.subtitle.text = "Generated by AI Assistant"
+
+    @staticmethod
+    def _message_charts(message):
+        # Handle both single charts and lists of charts
+        charts = message.get("chart") or []
+        return charts if isinstance(charts, list) else [charts]
+
+    def update(self, messages):
+        """Append slides for messages added since the last update and return how many were added"""
+        from pptx.util import Inches
+        new_messages = messages[self.message_count:]
+        with span("export_figures"):
+            assistant_messages = [
+                (message, self.figures_for(message)) for message in new_messages if message["role"] == "assistant"
+            ]
+        
+        all_charts = [chart for _, charts in assistant_messages for chart in charts]
+        if all_charts:
+            logger.info(f"Rendering {len(all_charts)} charts for PowerPoint...")
+        with span("export_render"):
+            images = iter(render_charts(all_charts, self.preset))
         
-        for message in messages:
-            if message["role"] == "assistant":
+        with span("export_slides"):
+            for message, charts in assistant_messages:
                 # Create a new slide for text content
-                text_slide = prs.slides.add_slide(prs.slide_layouts[6])
+                text_slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
                 add_text_to_slide(text_slide, "Analysis", is_title=True)
                 add_text_to_slide(text_slide, str(message["content"]))
-                
-                # Handle charts
-                if "chart" in message and message["chart"] is not None:
-                    charts_to_process = []
-                    
-                    # Handle both single charts and lists of charts
-                    if isinstance(message["chart"], list):
-                        charts_to_process.extend(message["chart"])
-                    else:
-                        charts_to_process.append(message["chart"])
+            
+                for chart in charts:
+                    image = next(images)
+                    if image is None:
+                        logger.error("Failed to render chart as image")
+                        continue
+                    try:
+                        chart_slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
+                        chart_title = _chart_title(chart)
+                        add_text_to_slide(chart_slide, chart_title, is_title=True)
                     
-                    # Process each chart
-                    for chart in charts_to_process:
-                        try:
-                            logger.info("Processing chart for PowerPoint...")
-                            
-                            # Save the chart as an image
-                            chart_image_path = save_chart_as_image(chart)
-                            if chart_image_path:
-                                temp_files.append(chart_image_path)
-                                
-                                # Create chart slide
-                                chart_slide = prs.slides.add_slide(prs.slide_layouts[6])
-                                
-                                # Try to get chart title from layout
-                                chart_title = "Visualization"
-                                try:
-                                    if hasattr(chart, 'layout') and chart.layout.title:
-                                        chart_title = chart.layout.title.text
-                                except:
-                                    pass
-                                
-                                add_text_to_slide(chart_slide, chart_title, is_title=True)
-                                
-                                # Add the chart image
-                                left = Inches(1)
-                                top = Inches(1.5)
-                                width = Inches(8)
-                                chart_slide.shapes.add_picture(chart_image_path, left, top, width=width)
-                                logger.info(f"Chart '{chart_title}' successfully added to slide")
-                            else:
-                                logger.error("Failed to save chart as image")
-                                
-                        except Exception as e:
-                            logger.error(f"Error adding chart to slide: {str(e)}")
-                            continue
-        
-        # Save the presentation
-        temp_pptx = tempfile.NamedTemporaryFile(delete=False, suffix=".pptx")
-        prs.save(temp_pptx.name)
-        logger.info(f"Presentation saved successfully to {temp_pptx.name}")
-        
-        # Clean up temporary files
-        for temp_file in temp_files:
-            try:
-                os.remove(temp_file)
-                logger.info(f"Cleaned up temporary file: {temp_file}")
-            except Exception as e:
-                logger.error(f"Error cleaning up temporary file {temp_file}: {str(e)}")
-        
-        return temp_pptx.name
+                        # Add the chart image
+                        left = Inches(1)
+                        top = Inches(1.5)
+                        width = Inches(8)
+                        chart_slide.shapes.add_picture(io.BytesIO(image), left, top, width=width)
+                        logger.info(f"Chart '{chart_title}' successfully added to slide")
+                    except Exception as e:
+                        logger.error(f"Error adding chart to slide: {str(e)}")
+                        continue
         
+        self.message_count = len(messages)
+        return len(new_messages)
+
+    def to_bytes(self):
+        """The deck as .pptx bytes"""
+        with span("export_save"):
+            buffer = io.BytesIO()
+            self.prs.save(buffer)
+            return buffer.getvalue()
+
+def create_presentation(messages, preset=EXPORT_IMAGE_PRESET):
+    """Create a PowerPoint presentation from chat messages and return it as .pptx bytes
+
+    All chart images are rendered in parallel first, then the deck is
+    assembled in message order.
+    """
+    try:
+        builder = PresentationBuilder(preset)
+        builder.update(messages)
+        return builder.to_bytes()
     except Exception as e:
         logger.error(f"Error creating presentation: {str(e)}")
-        
-        # Clean up temporary files in case of error
-        for temp_file in temp_files:
-            try:
-                os.remove(temp_file)
-            except:
-                pass
-                
-        return None
\ No newline at end of file
+        return None